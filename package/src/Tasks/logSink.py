@@ -0,0 +1,153 @@
+"""
+后台日志写入：文件只打开一次，调用方只把消息放进缓冲区，由写线程攒够大小或到时间再统一写盘
+文件超过大小上限时轮转成 log.txt.1、log.txt.2 ...，应用关闭时把剩下的缓冲写完
+
+LOG_PATH            日志文件，默认 log.txt
+LOG_MAX_BYTES       单个文件大小上限（字节），0 不轮转
+LOG_BACKUPS         轮转保留的旧文件个数
+LOG_FLUSH_BYTES     缓冲超过这个大小立即写盘
+LOG_FLUSH_INTERVAL  最长多久写一次盘（秒）
+LOG_MAX_PENDING     缓冲上限（字节），磁盘跟不上时丢弃新消息，避免内存无限增长
+"""
+import atexit
+import logging
+import os
+import threading
+from typing import BinaryIO, List, Union
+
+
+logger = logging.getLogger(__name__)
+
+
+class LogSink:
+    def __init__(
+        self,
+        path: str = "log.txt",
+        max_bytes: int = 10 * 1024 * 1024,
+        backups: int = 5,
+        flush_bytes: int = 64 * 1024,
+        flush_interval: float = 1.0,
+        max_pending: int = 16 * 1024 * 1024,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.buffer: List[str] = []
+        self.pending = 0
+        self.cond = threading.Condition()
+        self.closing = False
+        self.thread: Union[threading.Thread, None] = None
+        self.file: Union[BinaryIO, None] = None
+        self.size = 0
+        self.written = 0
+        self.flushes = 0
+        self.rotations = 0
+        self.dropped = 0
+
+    def write(self, message: str):
+        # !只追加到缓冲区，线程安全，事件循环和线程池里都可以直接调用
+        with self.cond:
+            if self.closing:
+                self.dropped += 1
+                return
+            if self.pending + len(message) > self.max_pending:
+                self.dropped += 1
+                return
+            self.buffer.append(message)
+            self.pending += len(message)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+                self.thread.start()
+            if self.pending >= self.flush_bytes:
+                self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if not self.closing and self.pending < self.flush_bytes:
+                    self.cond.wait(self.flush_interval)
+                batch, self.buffer, self.pending = self.buffer, [], 0
+                closing = self.closing
+            if batch:
+                self._flush(batch)
+            if closing:
+                with self.cond:
+                    # 关闭前最后一轮可能又有人写进来
+                    batch, self.buffer, self.pending = self.buffer, [], 0
+                if batch:
+                    self._flush(batch)
+                break
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _open(self):
+        # 二进制追加，大小按字节统计，中文一个字符占多个字节
+        self.file = open(self.path, mode="ab")
+        self.size = self.file.tell()
+
+    def _flush(self, batch: List[str]):
+        try:
+            if self.file is None:
+                self._open()
+            data = "".join(batch).encode()
+            self.file.write(data)
+            self.file.flush()
+            self.size += len(data)
+            self.written += len(batch)
+            self.flushes += 1
+            if self.max_bytes and self.size >= self.max_bytes:
+                self._rotate()
+        except OSError:
+            # 写不进去就丢掉这一批，不能让写线程退出
+            self.dropped += len(batch)
+            logger.exception("log sink: write to %s failed", self.path)
+
+    def _rotate(self):
+        # log.txt.4 -> log.txt.5，...，log.txt -> log.txt.1，超出个数的直接覆盖
+        self.file.close()
+        self.file = None
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+        self._open()
+
+    def close(self, timeout: Union[float, None] = 10):
+        # 把缓冲写完再关文件；会阻塞，在事件循环里用 asyncio.to_thread 调用
+        with self.cond:
+            self.closing = True
+            self.cond.notify()
+            thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "written": self.written,
+            "flushes": self.flushes,
+            "rotations": self.rotations,
+            "dropped": self.dropped,
+            "size": self.size,
+        }
+
+
+log_sink = LogSink(
+    path=os.getenv("LOG_PATH", "log.txt"),
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    backups=int(os.getenv("LOG_BACKUPS", "5")),
+    flush_bytes=int(os.getenv("LOG_FLUSH_BYTES", str(64 * 1024))),
+    flush_interval=float(os.getenv("LOG_FLUSH_INTERVAL", "1")),
+    max_pending=int(os.getenv("LOG_MAX_PENDING", str(16 * 1024 * 1024))),
+)
+# 没走 lifespan 的场景（脚本、测试）退出时也把缓冲写完
+atexit.register(log_sink.close)
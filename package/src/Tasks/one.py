@@ -1,9 +1,10 @@
 from fastapi import BackgroundTasks, Depends
+from Tasks.logSink import log_sink
 
 
-def write_log(message: str):
-    with open("log.txt", mode="a") as log:
-        log.write(message)
+# !只是放进缓冲区，由 log_sink 的写线程批量写盘；async 函数直接在事件循环里执行，不占线程池
+async def write_log(message: str):
+    log_sink.write(message)
 
 
 def get_query(background_tasks: BackgroundTasks, q: str | None = None):
@@ -12,3 +13,9 @@ def get_query(background_tasks: BackgroundTasks, q: str | None = None):
         background_tasks.add_task(write_log, message)
     return q
 
+
+# !由任务队列在进程池里执行，慢的外部调用（发邮件、推送）不占用处理请求的进程
+def send_email(email: str, message: str):
+    with open("notifications.txt", mode="a") as outbox:
+        outbox.write(f"{email}: {message}")
+
@@ -0,0 +1,449 @@
+"""
+持久化任务队列：任务先写进本地 sqlite，再由进程池执行，重启不丢、慢任务不占用处理请求的进程
+用法和 BackgroundTasks 一样：tasks: QueuedTasks = Depends(get_tasks)，然后 tasks.add_task(func, *args, **kwargs)
+
+任务函数必须是模块顶层函数（进程池里按 "模块:函数名" 重新导入），参数要能转成 JSON
+执行失败或超时按指数退避重试，超过次数标记为 failed 留在库里；成功的直接删除
+多个 uvicorn worker 共用同一个库文件，领取任务时在同一个事务里抢占，不会重复执行
+
+TASK_DB            sqlite 文件，默认 tasks.db
+TASK_WORKERS       进程池大小
+TASK_MAX_RETRIES   失败后最多重试次数
+TASK_TIMEOUT       单个任务超时（秒）
+TASK_RETRY_DELAY   第一次重试的等待时间（秒），之后每次翻倍
+TASK_POLL_INTERVAL 没有新任务时多久查一次库（秒），其他 worker 写入的任务靠它发现
+TASK_MP_CONTEXT    进程启动方式，默认 spawn，避免 fork 带走事件循环和线程
+
+超时优先在子进程里用 SIGALRM 打断任务；Windows 没有 setitimer，只能等主进程的兜底超时重建进程池
+"""
+import asyncio
+import importlib
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sqlite3
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterator, Callable, Dict, List, Set, Tuple, Union
+
+
+# 进程池自己的超时失效时，主进程最多再多等这么久就放弃这个任务并重建进程池
+GRACE = 5.0
+# 调度循环出错（库被锁、磁盘满）后的最长退避时间（秒）
+MAX_BACKOFF = 30.0
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+create table if not exists tasks (
+    id integer primary key autoincrement,
+    func text not null,
+    args text not null,
+    kwargs text not null,
+    status text not null default 'queued',
+    attempts integer not null default 0,
+    max_retries integer not null,
+    timeout real not null,
+    run_at real not null,
+    lease_until real,
+    created real not null,
+    error text
+);
+create index if not exists tasks_due on tasks(status, run_at);
+"""
+
+
+class TaskTimeout(Exception):
+    pass
+
+
+def task_ref(func: Callable) -> str:
+    # !只能传顶层函数，闭包和 lambda 在子进程里导入不到
+    ref = f"{func.__module__}:{func.__qualname__}"
+    if "<" in func.__qualname__ or func.__module__ == "__main__":
+        raise ValueError(f"任务函数必须是可导入的模块顶层函数: {ref}")
+    return ref
+
+
+def resolve(ref: str) -> Callable:
+    module, _, name = ref.partition(":")
+    target: Any = importlib.import_module(module)
+    for part in name.split("."):
+        target = getattr(target, part)
+    return target
+
+
+def _alarm(signum, frame):
+    raise TaskTimeout()
+
+
+def execute(ref: str, args: list, kwargs: dict, timeout: float) -> Any:
+    # !在进程池里执行，用定时信号实现超时，超时后这个子进程还能继续接下一个任务
+    alarm = hasattr(signal, "setitimer")
+    if alarm:
+        signal.signal(signal.SIGALRM, _alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        func = resolve(ref)
+        result = func(*args, **kwargs)
+        if inspect.isawaitable(result):
+            result = asyncio.run(result)
+        return result
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class TaskStore:
+    """
+    sqlite 里的任务表，所有方法都是阻塞的，由 TaskQueue 放到线程里调用
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute("pragma journal_mode=wal")
+        self.conn.execute("pragma synchronous=normal")
+        self.conn.executescript(SCHEMA)
+
+    def add(self, rows: List[Tuple[str, str, str, int, float]]) -> List[int]:
+        now = time.time()
+        with self.lock:
+            self.conn.execute("begin immediate")
+            try:
+                ids = [
+                    self.conn.execute(
+                        "insert into tasks(func, args, kwargs, max_retries, timeout, run_at, created) values (?, ?, ?, ?, ?, ?, ?)",
+                        (func, args, kwargs, max_retries, timeout, now, now),
+                    ).lastrowid
+                    for func, args, kwargs, max_retries, timeout in rows
+                ]
+                self.conn.execute("commit")
+            except BaseException:
+                self.conn.execute("rollback")
+                raise
+        return ids
+
+    def claim(self, limit: int) -> List[tuple]:
+        # 到期的排队任务，以及租约过期（领取它的进程挂了）的运行中任务
+        now = time.time()
+        with self.lock:
+            self.conn.execute("begin immediate")
+            try:
+                rows = self.conn.execute(
+                    """
+                    update tasks set status = 'running', attempts = attempts + 1, lease_until = ? + timeout + ?
+                    where id in (
+                        select id from tasks
+                        where (status = 'queued' and run_at <= ?) or (status = 'running' and lease_until < ?)
+                        order by run_at, id limit ?
+                    )
+                    returning id, func, args, kwargs, attempts, max_retries, timeout
+                    """,
+                    (now, GRACE, now, now, limit),
+                ).fetchall()
+                self.conn.execute("commit")
+            except BaseException:
+                self.conn.execute("rollback")
+                raise
+        return rows
+
+    def done(self, task_id: int):
+        with self.lock:
+            self.conn.execute("delete from tasks where id = ?", (task_id,))
+
+    def retry(self, task_id: int, run_at: float, error: str):
+        with self.lock:
+            self.conn.execute(
+                "update tasks set status = 'queued', run_at = ?, lease_until = null, error = ? where id = ?",
+                (run_at, error, task_id),
+            )
+
+    def requeue(self, task_id: int):
+        # 不是任务自己的问题（被别的任务连累），放回队列且不算一次尝试
+        with self.lock:
+            self.conn.execute(
+                "update tasks set status = 'queued', attempts = attempts - 1, run_at = ?, lease_until = null where id = ?",
+                (time.time(), task_id),
+            )
+
+    def fail(self, task_id: int, error: str):
+        with self.lock:
+            self.conn.execute(
+                "update tasks set status = 'failed', lease_until = null, error = ? where id = ?", (error, task_id)
+            )
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            rows = self.conn.execute("select status, count(*) from tasks group by status").fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class TaskQueue:
+    def __init__(
+        self,
+        path: str = "tasks.db",
+        workers: int = 2,
+        max_retries: int = 3,
+        timeout: float = 30,
+        retry_delay: float = 1,
+        poll_interval: float = 1,
+        mp_context: str = "spawn",
+    ):
+        self.path = path
+        self.workers = workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.mp_context = mp_context
+        self.store: Union[TaskStore, None] = None
+        self.pool: Union[ProcessPoolExecutor, None] = None
+        self.task: Union[asyncio.Task, None] = None
+        self.waiter: Union[asyncio.Future, None] = None
+        self.running: Set[asyncio.Task] = set()
+        # 因为有任务超时而被我们主动结束的进程池，里面其他任务的 BrokenProcessPool 不算它们的失败
+        self.killed: "weakref.WeakSet[ProcessPoolExecutor]" = weakref.WeakSet()
+        self.enqueued = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.timeouts = 0
+        self.requeued = 0
+        self.errors = 0
+        self.runtime = 0.0
+
+    def _store(self) -> TaskStore:
+        # 只入队、不执行的进程也能用，第一次用到时才打开库
+        if self.store is None:
+            self.store = TaskStore(self.path)
+        return self.store
+
+    async def start(self):
+        self._store()
+        self.pool = self._new_pool()
+        self.task = asyncio.create_task(self._dispatch())
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(self.mp_context))
+
+    async def enqueue(
+        self, func: Callable, *args, timeout: Union[float, None] = None, max_retries: Union[int, None] = None, **kwargs
+    ) -> int:
+        ids = await self.enqueue_many([(func, args, kwargs, timeout, max_retries)])
+        return ids[0]
+
+    async def enqueue_many(self, items: List[tuple]) -> List[int]:
+        # items: (函数, args, kwargs, 超时, 重试次数)，一个事务写入
+        rows = [
+            (
+                task_ref(func),
+                json.dumps(list(args), ensure_ascii=False),
+                json.dumps(kwargs, ensure_ascii=False),
+                self.max_retries if max_retries is None else max_retries,
+                self.timeout if timeout is None else timeout,
+            )
+            for func, args, kwargs, timeout, max_retries in items
+        ]
+        ids = await asyncio.to_thread(self._store().add, rows)
+        self.enqueued += len(ids)
+        self._wake()
+        return ids
+
+    async def _dispatch(self):
+        backoff = self.poll_interval
+        while True:
+            free = self.workers - len(self.running)
+            try:
+                rows = await asyncio.to_thread(self.store.claim, free) if free > 0 else []
+            except Exception:
+                # !库被锁或磁盘满时不能让调度协程退出，否则队列再也不会被消费
+                self.errors += 1
+                logger.exception("task queue: claim failed, retry in %.1fs", backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            backoff = self.poll_interval
+            for row in rows:
+                task = asyncio.create_task(self._execute(*row))
+                self.running.add(task)
+                task.add_done_callback(self._finished)
+            if rows and len(self.running) < self.workers:
+                # 可能还有更多到期的任务，接着领
+                continue
+            # 等新任务入队、有进程空出来，或者到点再查一次库
+            loop = asyncio.get_running_loop()
+            self.waiter = loop.create_future()
+            timer = loop.call_later(self.poll_interval, self._wake)
+            try:
+                await self.waiter
+            finally:
+                timer.cancel()
+                self.waiter = None
+
+    def _wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def _finished(self, task: asyncio.Task):
+        self.running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # 更新任务状态失败，行会停在 running，租约过期后重新执行
+            self.errors += 1
+            logger.error("task queue: task bookkeeping failed", exc_info=task.exception())
+        self._wake()
+
+    async def _execute(self, task_id, ref, args, kwargs, attempts, max_retries, timeout):
+        if attempts > max_retries + 1:
+            # 反复在执行中挂掉（租约过期被重新领取）的任务
+            await asyncio.to_thread(self.store.fail, task_id, "lease expired")
+            self.failed += 1
+            return
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        # 记下提交到的是哪个进程池，只有它仍是当前进程池时才重建，避免一次超时连锁重建
+        pool = self.pool
+        try:
+            future = loop.run_in_executor(pool, execute, ref, json.loads(args), json.loads(kwargs), timeout)
+            await asyncio.wait_for(future, timeout + GRACE)
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                # 调度本身被取消（关闭应用），交给租约处理
+                raise
+            # 进程池关闭时排队中的任务被取消，不是任务的错
+            await self._requeue(task_id)
+        except asyncio.TimeoutError as e:
+            # 子进程里的超时没生效（卡在 C 代码里或没有 SIGALRM），结束整个进程池
+            self.timeouts += 1
+            self._reset_pool(pool)
+            await self._failed(task_id, attempts, max_retries, repr(e))
+        except BrokenProcessPool as e:
+            if pool in self.killed:
+                # 同一进程池里别的任务超时，整个池被我们结束了
+                await self._requeue(task_id)
+            else:
+                # 子进程崩溃，不知道是哪个任务引起的，池里的任务都算一次失败
+                self._reset_pool(pool)
+                await self._failed(task_id, attempts, max_retries, repr(e))
+        except TaskTimeout:
+            self.timeouts += 1
+            await self._failed(task_id, attempts, max_retries, f"timeout after {timeout}s")
+        except Exception as e:
+            await self._failed(task_id, attempts, max_retries, repr(e))
+        else:
+            await asyncio.to_thread(self.store.done, task_id)
+            self.completed += 1
+        finally:
+            self.runtime += time.monotonic() - started
+
+    async def _failed(self, task_id: int, attempts: int, max_retries: int, error: str):
+        if attempts <= max_retries:
+            self.retried += 1
+            run_at = time.time() + self.retry_delay * 2 ** (attempts - 1)
+            await asyncio.to_thread(self.store.retry, task_id, run_at, error)
+        else:
+            self.failed += 1
+            await asyncio.to_thread(self.store.fail, task_id, error)
+
+    async def _requeue(self, task_id: int):
+        self.requeued += 1
+        await asyncio.to_thread(self.store.requeue, task_id)
+
+    def _reset_pool(self, pool: ProcessPoolExecutor):
+        if pool is not self.pool:
+            # 已经被别的任务重建过
+            return
+        self.killed.add(pool)
+        self.pool = self._new_pool()
+        # ProcessPoolExecutor 没有公开的结束子进程的方法，卡死的进程只能直接结束
+        for process in list(getattr(pool, "_processes", {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def stop(self):
+        # 不再领新任务，等正在执行的跑完；没跑完的留在库里，下次启动租约过期后重新执行
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.running:
+            await asyncio.wait(set(self.running), timeout=self.timeout + GRACE)
+        if self.pool is not None:
+            await asyncio.to_thread(self.pool.shutdown, True, cancel_futures=True)
+            self.pool = None
+        if self.running:
+            # 被取消的排队任务还要把状态写回库里
+            await asyncio.wait(set(self.running), timeout=GRACE)
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    async def stats(self) -> dict:
+        counts = await asyncio.to_thread(self._store().counts)
+        executed = self.completed + self.failed + self.retried
+        return {
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "failedStored": counts.get("failed", 0),
+            "workers": self.workers,
+            "busy": len(self.running),
+            "enqueued": self.enqueued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "timeouts": self.timeouts,
+            "requeued": self.requeued,
+            "errors": self.errors,
+            "avgRuntime": round(self.runtime / executed, 4) if executed else 0,
+        }
+
+
+class QueuedTasks:
+    """
+    和 BackgroundTasks 的用法一致，接口正常返回后一次性写入队列；接口抛异常则不入队
+    """
+
+    def __init__(self, queue: TaskQueue):
+        self.queue = queue
+        self.items: List[tuple] = []
+
+    def add_task(self, func: Callable, *args, **kwargs):
+        task_ref(func)
+        self.items.append((func, args, kwargs, None, None))
+
+    def add(
+        self, func: Callable, *args, timeout: Union[float, None] = None, max_retries: Union[int, None] = None, **kwargs
+    ):
+        # 单独指定超时和重试次数
+        task_ref(func)
+        self.items.append((func, args, kwargs, timeout, max_retries))
+
+
+task_queue = TaskQueue(
+    path=os.getenv("TASK_DB", "tasks.db"),
+    workers=int(os.getenv("TASK_WORKERS", "2")),
+    max_retries=int(os.getenv("TASK_MAX_RETRIES", "3")),
+    timeout=float(os.getenv("TASK_TIMEOUT", "30")),
+    retry_delay=float(os.getenv("TASK_RETRY_DELAY", "1")),
+    poll_interval=float(os.getenv("TASK_POLL_INTERVAL", "1")),
+    mp_context=os.getenv("TASK_MP_CONTEXT", "spawn"),
+)
+
+
+async def get_tasks() -> AsyncIterator[QueuedTasks]:
+    # !FastAPI 依赖：tasks: QueuedTasks = Depends(get_tasks)
+    tasks = QueuedTasks(task_queue)
+    yield tasks
+    if tasks.items:
+        await task_queue.enqueue_many(tasks.items)
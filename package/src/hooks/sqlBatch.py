@@ -0,0 +1,137 @@
+"""
+写合并（group commit）：短时间窗口内并发到达的写语句攒成一批，在一个事务里提交
+连续的同一条 SQL 合并成一次 executemany（mysql 驱动会改写成多行 insert），提交成功后统一唤醒各个调用方
+
+一批里有语句失败时整批回滚，再逐条单独提交，坏数据只影响它自己的调用方
+"""
+import asyncio
+import itertools
+from typing import Any, Callable, List, Set, Tuple, Union
+from sqlalchemy import text, exc
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+Write = Tuple[str, dict, asyncio.Future]
+
+
+class WriteBatcher:
+    def __init__(
+        self,
+        get_engine: Callable[[], AsyncEngine],
+        window: float = 0.005,
+        max_batch: int = 500,
+        on_commit: Union[Callable[[Set[str]], Any], None] = None,
+        tables: Union[Callable[[str], Set[str]], None] = None,
+    ):
+        self.get_engine = get_engine
+        self.window = window
+        self.max_batch = max_batch
+        # 提交成功后的回调，例如让查询缓存按表失效
+        self.on_commit = on_commit
+        self.tables = tables
+        self.queue: Union[asyncio.Queue, None] = None
+        self.task: Union[asyncio.Task, None] = None
+        self.batches = 0
+        self.writes = 0
+        self.statements = 0
+        self.retried = 0
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self._run())
+
+    async def submit(self, SQL: str, params: Union[dict, None] = None) -> dict:
+        # !返回值与 get_db 一致：{"status": 1} 成功，0 违反约束，-1 其他错误；在所在批次提交后才返回
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((SQL, params or {}, future))
+        return await future
+
+    async def _collect(self) -> List[Write]:
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # 窗口结束时队列里已有的也顺带带上
+        while len(batch) < self.max_batch and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                await self._commit(batch)
+            except Exception:
+                # 整批失败，逐条重试，各自拿到自己的结果
+                self.retried += len(batch)
+                for write in batch:
+                    await self._commit_one(write)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _commit(self, batch: List[Write]):
+        # 只合并相邻的同一条 SQL，保证不同语句之间的先后顺序不变
+        groups = [list(group) for _, group in itertools.groupby(batch, key=lambda w: w[0])]
+        async with self.get_engine().begin() as conn:
+            for group in groups:
+                SQL = group[0][0]
+                params = [w[1] for w in group]
+                await conn.execute(text(SQL), params if len(params) > 1 else params[0])
+        self.batches += 1
+        self.writes += len(batch)
+        self.statements += len(groups)
+        self._committed({w[0] for w in batch})
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result({"status": 1})
+
+    async def _commit_one(self, write: Write):
+        SQL, params, future = write
+        try:
+            async with self.get_engine().begin() as conn:
+                await conn.execute(text(SQL), params)
+        except exc.IntegrityError as e:
+            result = {"status": 0, "message": str(e.orig), "data": None}
+        except Exception as e:
+            result = {"status": -1, "message": e}
+        else:
+            result = {"status": 1}
+            self._committed({SQL})
+        if not future.done():
+            future.set_result(result)
+
+    def _committed(self, statements: Set[str]):
+        if self.on_commit is None or self.tables is None:
+            return
+        tables: Set[str] = set()
+        for SQL in statements:
+            tables |= self.tables(SQL)
+        self.on_commit(tables)
+
+    async def close(self):
+        # 关闭前把已经排队的写入提交完
+        if self.task is None:
+            return
+        await self.queue.join()
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.queue.qsize() if self.queue is not None else 0,
+            "batches": self.batches,
+            "writes": self.writes,
+            "statements": self.statements,
+            "retried": self.retried,
+            "avgBatch": round(self.writes / self.batches, 2) if self.batches else 0,
+        }
@@ -0,0 +1,181 @@
+"""
+查询结果缓存：按 (规范化 SQL, 参数) 缓存 select 结果，LRU + TTL 淘汰，并限制总内存
+写语句（insert/update/delete...）经过同一层时，按表名失效相关缓存
+
+只有经过 sqlClient.get_db 的读写才会被缓存/失效，直接用会话或其他程序改表的，靠 TTL 兜底
+"""
+import asyncio
+import re
+import sys
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Set, Tuple, Union
+from sqlalchemy.engine import FrozenResult
+
+
+_SPACES = re.compile(r"\s+")
+_READ = re.compile(r"^\s*(select|with)\b", re.I)
+# 读语句涉及的表：from / join 后面的表名
+_READ_TABLES = re.compile(r"\b(?:from|join)\s+[`\"]?([\w.]+)", re.I)
+# 写语句影响的表
+_WRITE_TABLES = re.compile(
+    r"\b(?:insert\s+(?:ignore\s+)?into|replace\s+into|update|delete\s+from|truncate(?:\s+table)?|drop\s+table(?:\s+if\s+exists)?|alter\s+table)\s+[`\"]?([\w.]+)",
+    re.I,
+)
+
+
+def normalize(SQL: str) -> str:
+    # 合并空白、去掉结尾分号；不改大小写，避免改到字符串常量
+    return _SPACES.sub(" ", SQL).strip().rstrip(";").strip()
+
+
+def is_read(SQL: str) -> bool:
+    return bool(_READ.match(SQL))
+
+
+def read_tables(SQL: str) -> Set[str]:
+    return {t.lower() for t in _READ_TABLES.findall(SQL)}
+
+
+def write_tables(SQL: str) -> Set[str]:
+    return {t.lower() for t in _WRITE_TABLES.findall(SQL)}
+
+
+def _sizeof(frozen: FrozenResult) -> int:
+    # 粗略估算占用：每个值的大小 + 每行固定开销
+    rows = frozen.data
+    return sum(sys.getsizeof(v) for row in rows for v in row) + 64 * len(rows) + 256
+
+
+class Entry:
+    __slots__ = ("frozen", "expires", "size", "tables")
+
+    def __init__(self, frozen: FrozenResult, expires: float, size: int, tables: Set[str]):
+        self.frozen = frozen
+        self.expires = expires
+        self.size = size
+        self.tables = tables
+
+
+class QueryCache:
+    def __init__(self, ttl: float = 30, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Hashable, Entry]" = OrderedDict()
+        # 表名 -> 缓存 key，写入时按表失效
+        self.tables: Dict[str, Set[Hashable]] = {}
+        # 表版本号：查询期间表被写过，结果就不缓存，防止旧数据写回缓存
+        self.versions: Dict[str, int] = {}
+        # 同一个 key 同时只有一个查询打到数据库，其他请求等它的结果
+        self.inflight: Dict[Hashable, asyncio.Future] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(SQL: str, params: Union[dict, None]) -> Union[Tuple[str, Tuple], None]:
+        key = normalize(SQL), tuple(sorted((params or {}).items(), key=lambda kv: kv[0]))
+        try:
+            hash(key)
+        except TypeError:
+            # 参数里有列表等不可哈希的值，不缓存
+            return None
+        return key
+
+    def get(self, key: Hashable) -> Union[FrozenResult, None]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic():
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry.frozen
+
+    def put(self, key: Hashable, frozen: FrozenResult, tables: Set[str]):
+        size = _sizeof(frozen)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = Entry(frozen, time.monotonic() + self.ttl, size, tables)
+        self.bytes += size
+        for table in tables:
+            self.tables.setdefault(table, set()).add(key)
+        # !超出条数或内存上限时从最久未用的开始淘汰
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry.size
+        for table in entry.tables:
+            keys = self.tables.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tables[table]
+
+    def invalidate(self, tables: Set[str]):
+        for table in tables:
+            self.versions[table] = self.versions.get(table, 0) + 1
+            for key in list(self.tables.get(table, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.tables.clear()
+        self.bytes = 0
+
+    async def read_through(
+        self, SQL: str, params: Union[dict, None], load: Callable[[], Awaitable[FrozenResult]]
+    ) -> FrozenResult:
+        """
+        先查缓存，未命中时调用 load 查库并写入缓存；load 抛出的异常原样抛给调用方
+        """
+        key = self.key(SQL, params)
+        if key is None:
+            return await load()
+        frozen = self.get(key)
+        if frozen is not None:
+            self.hits += 1
+            return frozen
+        waiting = self.inflight.get(key)
+        if waiting is not None:
+            frozen = await asyncio.shield(waiting)
+            if frozen is not None:
+                self.hits += 1
+                return frozen
+        self.misses += 1
+        tables = read_tables(SQL)
+        versions = {t: self.versions.get(t, 0) for t in tables}
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        frozen = None
+        try:
+            frozen = await load()
+            # 查询期间表没有被写过才缓存
+            if all(self.versions.get(t, 0) == v for t, v in versions.items()):
+                self.put(key, frozen, tables)
+            return frozen
+        finally:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+            future.set_result(frozen)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -5,7 +5,9 @@ from fastapi import FastAPI
 from typing import Union
 from enum import Enum
 
+import asyncio
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import Response, JSONResponse, ORJSONResponse, RedirectResponse
 
@@ -20,6 +22,10 @@ from routers import index
 
 
 from plugs.demo import plugs
+from two.two import manager
+from hooks import sqlClient
+from Tasks.logSink import log_sink
+from Tasks.taskQueue import task_queue
 
 description = """
 ChimichangApp API helps you do awesome stuff. 🚀
@@ -37,7 +43,20 @@ You will be able to:
 """
 
 
+# !应用生命周期：启动时连上广播背板、启动任务进程池，关闭时依次停掉，再关闭数据库连接池、写完日志缓冲
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await manager.start()
+    await task_queue.start()
+    yield
+    await task_queue.stop()
+    await manager.stop()
+    await sqlClient.close_db()
+    await asyncio.to_thread(log_sink.close)
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title="简单小项目",
     description=description,
     version="0.0.1",
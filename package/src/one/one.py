@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Path, Query, Body, Cookie, Header, status, Form, File, UploadFile, HTTPException
+from fastapi import APIRouter, Path, Query, Body, Cookie, Header, status, Form, File, UploadFile, HTTPException, Request, Response
+from one.uploads import UploadError, save_upload, upload_store
 
 
 # !强制类型验证
@@ -293,18 +294,74 @@ UploadFile 与 bytes 相比有更多优势：
 """
 
 
-# !上传文件接口，bytes会一直占用内存，
+# !上传文件接口，bytes会一直占用内存，这里改成 UploadFile 按块读写，边写盘边算 sha256
 @router.post("/files/")
-async def create_file(file: bytes = File()):
-    return {"file_size": len(file)}
+async def create_file(file: UploadFile = File()):
+    try:
+        saved = await save_upload(file)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status, detail=e.detail)
+    return {"file_size": saved["size"], "sha256": saved["sha256"]}
 
 
-# !推荐使用，方法更多，占用内存少
+# !推荐使用，方法更多，占用内存少；不要 await file.read() 一次读完
 @router.post("/uploadfile/")
 async def create_upload_file(file: UploadFile):
-    contents = await file.read()
-    print(contents)
-    return {"filename": file.filename}
+    try:
+        saved = await save_upload(file)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status, detail=e.detail)
+    return saved
+
+
+# !可续传的分块上传，大文件断了可以从 offset 接着传，协议说明见 one/uploads.py
+def upload_headers(info: dict) -> dict:
+    return {"Upload-Offset": str(info["offset"]), "Upload-Length": str(info["size"]), "ETag": info["etag"]}
+
+
+@router.post("/uploads", status_code=status.HTTP_201_CREATED)
+async def create_upload(response: Response, filename: str, size: int = Query(ge=0)):
+    try:
+        info = upload_store.create(filename, size).info()
+    except UploadError as e:
+        raise HTTPException(status_code=e.status, detail=e.detail)
+    response.headers.update(upload_headers(info))
+    response.headers["Location"] = f"/one/uploads/{info['id']}"
+    return info
+
+
+@router.head("/uploads/{upload_id}")
+async def upload_offset(upload_id: str):
+    try:
+        upload = await upload_store.state(upload_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status, detail=e.detail)
+    return Response(headers={**upload_headers(upload.info()), "Cache-Control": "no-store"})
+
+
+@router.patch("/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    response: Response,
+    upload_offset: int = Header(alias="Upload-Offset"),
+    if_match: Union[str, None] = Header(default=None),
+):
+    # !请求体直接从 request.stream() 写盘，不经过表单解析，也不整块读进内存
+    try:
+        info = await upload_store.append(upload_id, upload_offset, request.stream(), if_match)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status, detail=e.detail)
+    response.headers.update(upload_headers(info))
+    return info
+
+
+@router.delete("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_upload(upload_id: str):
+    try:
+        await upload_store.delete(upload_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status, detail=e.detail)
 
 
 @router.post("/files2/")
@@ -0,0 +1,292 @@
+"""
+流式上传：请求体按块直接写盘，边写边算 sha256，内存占用只和块大小有关，与文件大小无关
+
+可续传的分块上传（和 tus 协议类似）：
+    POST   /one/uploads?filename=a.iso&size=123   创建上传，返回 id、offset、ETag
+    HEAD   /one/uploads/{id}                      查询已收到的字节数（Upload-Offset）和 ETag
+    PATCH  /one/uploads/{id}                      请求头带 Upload-Offset 和 If-Match，请求体是从 offset 开始的原始字节
+    DELETE /one/uploads/{id}                      放弃上传
+offset 对不上返回 409，ETag 对不上返回 412；中途断开时已写入的部分保留，客户端 HEAD 之后从新的 offset 继续
+
+UPLOAD_DIR        保存目录，默认 uploads
+UPLOAD_MAX_BYTES  单个文件大小上限（字节）
+UPLOAD_CHUNK      每次读写的块大小（字节）
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import uuid
+from contextlib import contextmanager
+from typing import AsyncIterator, BinaryIO, Dict, Iterator, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，只能单 worker 续传
+    fcntl = None
+
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(5 * 1024 * 1024 * 1024)))
+CHUNK = int(os.getenv("UPLOAD_CHUNK", str(1024 * 1024)))
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+_UNSAFE = re.compile(r"[^\w.\-]+")
+
+
+class UploadError(Exception):
+    # status 对应返回给客户端的 http 状态码
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+def safe_name(filename: Union[str, None]) -> str:
+    # 只保留文件名本身，去掉路径和特殊字符，防止写到保存目录以外
+    name = _UNSAFE.sub("_", os.path.basename(filename or "")).strip("._")
+    return name or "upload"
+
+
+async def write_stream(stream: AsyncIterator[bytes], file: BinaryIO, hasher, limit: int) -> int:
+    """
+    把异步字节流逐块写入文件并更新 hasher，返回写入的字节数；超过 limit 抛 413
+    写盘放到线程里，不阻塞事件循环；已写入的部分保留在文件里，由调用方决定是否删除
+    """
+    written = 0
+    async for chunk in stream:
+        if not chunk:
+            continue
+        if written + len(chunk) > limit:
+            raise UploadError(413, f"file exceeds {limit} bytes")
+        await asyncio.to_thread(file.write, chunk)
+        hasher.update(chunk)
+        written += len(chunk)
+    await asyncio.to_thread(file.flush)
+    return written
+
+
+async def read_upload(upload, chunk_size: int = CHUNK) -> AsyncIterator[bytes]:
+    # UploadFile 按块读，代替 await file.read() 一次读完
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def save_upload(upload, directory: str = UPLOAD_DIR, limit: int = MAX_BYTES) -> dict:
+    """
+    把表单上传的文件流式写到 directory，返回文件名、大小和 sha256；超过大小上限时删掉半截文件
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = f"{uuid.uuid4().hex}_{safe_name(upload.filename)}"
+    path = os.path.join(directory, name)
+    hasher = hashlib.sha256()
+    try:
+        with open(path, "wb") as file:
+            size = await write_stream(read_upload(upload), file, hasher, limit)
+    except BaseException:
+        os.remove(path)
+        raise
+    return {"filename": upload.filename, "stored": name, "size": size, "sha256": hasher.hexdigest()}
+
+
+class Upload:
+    def __init__(self, upload_id: str, filename: str, size: int):
+        self.id = upload_id
+        self.filename = filename
+        self.size = size
+        self.offset = 0
+        self.hasher = None
+        # 同一个上传同时只允许一个 PATCH 写入
+        self.lock = asyncio.Lock()
+
+    def etag(self) -> str:
+        # !ETag 由已收到的字节数和这些字节的摘要组成，内容或进度变了就会变
+        return f'"{self.offset}-{self.hasher.copy().hexdigest()[:16]}"'
+
+    def info(self) -> dict:
+        return {"id": self.id, "filename": self.filename, "size": self.size, "offset": self.offset, "etag": self.etag()}
+
+
+class UploadStore:
+    """
+    分块上传的状态：{id}.json 存元数据，{id}.part 存已收到的内容，收完后改名成最终文件
+    哈希状态只在内存里，进程重启后第一次访问时从 .part 文件重新计算
+
+    多 worker 时同一个上传的几次 PATCH 可能落在不同进程：写入前对 .part 加文件锁，
+    并以磁盘上的文件大小为准，别的进程追加过的部分在这里补算摘要
+    """
+
+    def __init__(self, directory: str = UPLOAD_DIR, max_bytes: int = MAX_BYTES, chunk_size: int = CHUNK):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.uploads: Dict[str, Upload] = {}
+
+    def _path(self, upload_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{upload_id}{suffix}")
+
+    def create(self, filename: str, size: int) -> Upload:
+        if size < 0:
+            raise UploadError(400, "size must not be negative")
+        if size > self.max_bytes:
+            raise UploadError(413, f"file exceeds {self.max_bytes} bytes")
+        os.makedirs(self.directory, exist_ok=True)
+        upload = Upload(uuid.uuid4().hex, safe_name(filename), size)
+        with open(self._path(upload.id, ".json"), "w") as meta:
+            json.dump({"filename": upload.filename, "size": size}, meta)
+        open(self._path(upload.id, ".part"), "wb").close()
+        upload.hasher = hashlib.sha256()
+        self.uploads[upload.id] = upload
+        return upload
+
+    async def get(self, upload_id: str) -> Upload:
+        if not _UPLOAD_ID.match(upload_id):
+            raise UploadError(404, "upload not found")
+        upload = self.uploads.get(upload_id)
+        if upload is not None:
+            return upload
+        try:
+            with open(self._path(upload_id, ".json")) as meta:
+                data = json.load(meta)
+        except FileNotFoundError:
+            raise UploadError(404, "upload not found")
+        upload = Upload(upload_id, data["filename"], data["size"])
+        upload.hasher = hashlib.sha256()
+        # 并发的两次 get 以先放进去的为准，offset 和摘要由 _refresh 从磁盘补齐
+        return self.uploads.setdefault(upload_id, upload)
+
+    async def state(self, upload_id: str) -> Upload:
+        # HEAD 用：返回和磁盘一致的进度；本进程正在写时内存里的就是最新的
+        upload = await self.get(upload_id)
+        if not upload.lock.locked():
+            async with upload.lock:
+                await self._refresh(upload)
+        return upload
+
+    async def _refresh(self, upload: Upload):
+        # 调用方持有 upload.lock；上传已被其他进程完成或删除时返回 404
+        if not os.path.exists(self._path(upload.id, ".json")):
+            self.uploads.pop(upload.id, None)
+            raise UploadError(404, "upload not found")
+        try:
+            await asyncio.to_thread(self._catch_up, upload)
+        except FileNotFoundError:
+            self.uploads.pop(upload.id, None)
+            raise UploadError(404, "upload not found")
+
+    def _catch_up(self, upload: Upload):
+        # .part 只会追加（出错时截回已计入摘要的位置），比内存里长就只补算多出来的部分
+        path = self._path(upload.id, ".part")
+        size = os.path.getsize(path)
+        if size == upload.offset:
+            return
+        if size < upload.offset:
+            upload.offset, upload.hasher = self._rehash(path)
+            return
+        with open(path, "rb") as file:
+            file.seek(upload.offset)
+            while upload.offset < size:
+                chunk = file.read(min(self.chunk_size, size - upload.offset))
+                if not chunk:
+                    break
+                upload.hasher.update(chunk)
+                upload.offset += len(chunk)
+
+    def _open_part(self, upload_id: str) -> BinaryIO:
+        # 不带 O_CREAT：上传已被其他 worker 完成或删除时报 FileNotFoundError，而不是重新建一个空文件
+        return open(os.open(self._path(upload_id, ".part"), os.O_WRONLY | os.O_APPEND), "ab")
+
+    @contextmanager
+    def _exclusive(self, file: BinaryIO) -> Iterator[None]:
+        # 跨进程互斥：另一个 worker 正在写这个上传时直接 409，不排队等待
+        if fcntl is None:
+            yield
+            return
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError(409, "another request is writing this upload")
+        try:
+            yield
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+    def _rehash(self, path: str) -> Tuple[int, "hashlib._Hash"]:
+        hasher = hashlib.sha256()
+        offset = 0
+        with open(path, "rb") as file:
+            while True:
+                chunk = file.read(self.chunk_size)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                offset += len(chunk)
+        return offset, hasher
+
+    async def append(
+        self, upload_id: str, offset: int, stream: AsyncIterator[bytes], if_match: Union[str, None] = None
+    ) -> dict:
+        upload = await self.get(upload_id)
+        if upload.lock.locked():
+            raise UploadError(409, "another request is writing this upload")
+        async with upload.lock:
+            try:
+                file = self._open_part(upload_id)
+            except FileNotFoundError:
+                self.uploads.pop(upload_id, None)
+                raise UploadError(404, "upload not found")
+            with file, self._exclusive(file):
+                await self._refresh(upload)
+                if offset != upload.offset:
+                    raise UploadError(409, f"offset mismatch, expected {upload.offset}")
+                if if_match is not None and if_match != upload.etag():
+                    raise UploadError(412, "etag mismatch")
+                limit = upload.size - upload.offset
+                try:
+                    async for chunk in stream:
+                        if not chunk:
+                            continue
+                        if len(chunk) > limit:
+                            raise UploadError(413, f"body exceeds declared size {upload.size}")
+                        await asyncio.to_thread(file.write, chunk)
+                        upload.hasher.update(chunk)
+                        upload.offset += len(chunk)
+                        limit -= len(chunk)
+                finally:
+                    # 中途出错或客户端断开：保留已经写入并计入摘要的部分，之后可以从 offset 续传
+                    file.truncate(upload.offset)
+                result = upload.info()
+                if upload.offset == upload.size:
+                    result.update(self._complete(upload))
+                return result
+
+    def _complete(self, upload: Upload) -> dict:
+        name = f"{upload.id}_{upload.filename}"
+        os.replace(self._path(upload.id, ".part"), os.path.join(self.directory, name))
+        os.remove(self._path(upload.id, ".json"))
+        self.uploads.pop(upload.id, None)
+        return {"complete": True, "stored": name, "sha256": upload.hasher.hexdigest()}
+
+    async def delete(self, upload_id: str):
+        upload = await self.get(upload_id)
+        if upload.lock.locked():
+            raise UploadError(409, "another request is writing this upload")
+        self.uploads.pop(upload_id, None)
+        try:
+            file = self._open_part(upload_id)
+        except FileNotFoundError:
+            file = None
+        if file is not None:
+            with file, self._exclusive(file):
+                os.remove(self._path(upload_id, ".part"))
+        try:
+            os.remove(self._path(upload_id, ".json"))
+        except FileNotFoundError:
+            pass
+
+
+upload_store = UploadStore()
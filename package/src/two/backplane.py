@@ -0,0 +1,294 @@
+"""
+websocket 广播背板：多个 uvicorn worker 之间转发广播，每条消息最多经过一跳
+
+local  只在本进程内广播（默认，单 worker）
+unix   unix socket 中转，抢到文件锁的 worker 兼任中转站，其他 worker 连上来；中转站挂了会被其他 worker 接替
+mqtt   走 mqtt broker（需要 paho-mqtt），与 secondaryAgency 用同一个 broker 即可
+
+环境变量：WS_BACKPLANE、WS_BACKPLANE_PATH、WS_BACKPLANE_MQTT_HOST、WS_BACKPLANE_MQTT_PORT、WS_BACKPLANE_TOPIC、
+WS_BACKPLANE_HIGH_WATER（中转站给单个 worker 积压的字节上限，超过就断开它，它会自动重连）
+"""
+import asyncio
+import json
+import os
+import struct
+import uuid
+from typing import Any, Awaitable, Callable, Set, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl 和 unix socket，只能用 local 或 mqtt
+    fcntl = None
+
+try:
+    import paho.mqtt.client as mqtt
+    from paho.mqtt.subscribeoptions import SubscribeOptions
+except ImportError:  # 可选依赖
+    mqtt = None
+
+
+# 收到其他 worker 的消息后交给它处理：(频道, 消息)，由接收方按各连接的编码再编码
+Handler = Callable[[str, Any], Union[Awaitable[None], None]]
+
+# !帧格式：消息体长度 + 频道长度 + 类型（0 文本 1 二进制 2 JSON 对象）+ 频道 + 消息体
+HEADER = struct.Struct("!IHB")
+KIND_TEXT = 0
+KIND_BYTES = 1
+KIND_JSON = 2
+
+
+def pack_body(message: Any) -> tuple:
+    if isinstance(message, str):
+        return KIND_TEXT, message.encode()
+    if isinstance(message, bytes):
+        return KIND_BYTES, message
+    return KIND_JSON, json.dumps(message, ensure_ascii=False).encode()
+
+
+def pack(channel: str, message: Any) -> bytes:
+    ch = channel.encode()
+    kind, body = pack_body(message)
+    return HEADER.pack(len(body), len(ch), kind) + ch + body
+
+
+def unpack_body(kind: int, body: bytes) -> Any:
+    if kind == KIND_BYTES:
+        return body
+    if kind == KIND_JSON:
+        return json.loads(body)
+    return body.decode()
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    # 返回 (原始帧, 频道, 消息)
+    head = await reader.readexactly(HEADER.size)
+    length, ch_len, kind = HEADER.unpack(head)
+    rest = await reader.readexactly(ch_len + length)
+    return head + rest, rest[:ch_len].decode(), unpack_body(kind, rest[ch_len:])
+
+
+class Backplane:
+    """
+    本进程广播，什么都不转发；其他实现继承它
+    """
+
+    name = "local"
+
+    def __init__(self):
+        self.handler: Union[Handler, None] = None
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+
+    async def start(self, handler: Handler):
+        self.handler = handler
+
+    async def stop(self):
+        pass
+
+    def publish(self, channel: str, message: Any):
+        pass
+
+    async def deliver(self, channel: str, message: Any):
+        self.received += 1
+        result = self.handler(channel, message)
+        if asyncio.iscoroutine(result):
+            await result
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+        }
+
+
+class UnixBackplane(Backplane):
+    name = "unix"
+
+    def __init__(self, path: str, retry: float = 0.2, high_water: int = 8 * 1024 * 1024):
+        if fcntl is None:
+            raise RuntimeError("WS_BACKPLANE=unix 不支持当前平台，请改用 mqtt")
+        super().__init__()
+        self.path = path
+        self.retry = retry
+        self.high_water = high_water
+        self.slow_peers = 0
+        self.lock_fd: Union[int, None] = None
+        self.server: Union[asyncio.AbstractServer, None] = None
+        self.peers: Set[asyncio.StreamWriter] = set()
+        self.writer: Union[asyncio.StreamWriter, None] = None
+        self.task: Union[asyncio.Task, None] = None
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        self.task = asyncio.create_task(self._run())
+
+    async def _ensure_broker(self):
+        # !用文件锁选出中转站，拿到锁的 worker 才能监听，避免互相删掉对方的 socket 文件
+        if self.server is not None:
+            return
+        if self.lock_fd is None:
+            self.lock_fd = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        # 残留的 socket 文件会被 start_unix_server 删掉重建
+        self.server = await asyncio.start_unix_server(self._relay, self.path)
+
+    async def _relay(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # 中转站：收到一个 worker 的帧，原样转给其他所有 worker
+        self.peers.add(writer)
+        try:
+            while True:
+                raw, _, _ = await read_frame(reader)
+                for peer in list(self.peers):
+                    if peer is writer or peer.is_closing():
+                        continue
+                    # !不等 drain，慢的 worker 会拖住所有转发；积压超过上限直接断开，让它重连
+                    if peer.transport.get_write_buffer_size() + len(raw) > self.high_water:
+                        self.slow_peers += 1
+                        self.peers.discard(peer)
+                        peer.transport.abort()
+                        continue
+                    peer.write(raw)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # 中转站关闭时会取消这些连接任务，直接结束即可
+            pass
+        finally:
+            self.peers.discard(writer)
+            writer.close()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._ensure_broker()
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(self.retry)
+                continue
+            self.writer = writer
+            try:
+                while True:
+                    _, channel, message = await read_frame(reader)
+                    await self.deliver(channel, message)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                self.writer = None
+                writer.close()
+            # 中转站可能挂了，稍等后重新竞选/重连
+            await asyncio.sleep(self.retry)
+
+    def publish(self, channel: str, message: Any):
+        writer = self.writer
+        if writer is None or writer.is_closing():
+            self.dropped += 1
+            return
+        writer.write(pack(channel, message))
+        self.published += 1
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        if self.server is not None:
+            self.server.close()
+            for peer in list(self.peers):
+                peer.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    def stats(self) -> dict:
+        data = super().stats()
+        data.update(
+            {
+                "connected": self.writer is not None,
+                "broker": self.server is not None,
+                "peers": len(self.peers),
+                "slowPeers": self.slow_peers,
+            }
+        )
+        return data
+
+
+class MqttBackplane(Backplane):
+    name = "mqtt"
+
+    def __init__(self, host: str, port: int = 1883, topic: str = "fastapi/ws"):
+        if mqtt is None:
+            raise RuntimeError("WS_BACKPLANE=mqtt 需要安装 paho-mqtt")
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.topic = topic
+        self.loop: Union[asyncio.AbstractEventLoop, None] = None
+        self.client = mqtt.Client(
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+            client_id=f"fastapi-ws-{uuid.uuid4().hex[:12]}",
+            protocol=mqtt.MQTTv5,
+        )
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        self.loop = asyncio.get_running_loop()
+        self.client.connect_async(self.host, self.port)
+        self.client.loop_start()
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        # *noLocal：broker 不把自己发的消息再推回来
+        if not reason_code.is_failure:
+            client.subscribe(f"{self.topic}/#", options=SubscribeOptions(qos=0, noLocal=True))
+
+    def _on_message(self, client, userdata, msg):
+        # paho 网络线程，交回事件循环处理
+        if len(msg.payload) < 2:
+            # 不是背板发的消息（例如空的保留消息清理），忽略
+            self.dropped += 1
+            return
+        channel = msg.topic[len(self.topic) + 1 :]
+        kind, body = msg.payload[0], msg.payload[1:]
+        message = unpack_body(kind, body)
+        asyncio.run_coroutine_threadsafe(self.deliver(channel, message), self.loop)
+
+    def publish(self, channel: str, message: Any):
+        if not self.client.is_connected():
+            self.dropped += 1
+            return
+        kind, body = pack_body(message)
+        payload = bytes([kind]) + body
+        self.client.publish(f"{self.topic}/{channel}", payload)
+        self.published += 1
+
+    async def stop(self):
+        # 先断开，网络线程还在才能把 DISCONNECT 发出去
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def stats(self) -> dict:
+        data = super().stats()
+        data["connected"] = self.client.is_connected()
+        return data
+
+
+def create_backplane() -> Backplane:
+    kind = os.getenv("WS_BACKPLANE", "local")
+    if kind == "unix":
+        return UnixBackplane(
+            os.getenv("WS_BACKPLANE_PATH", "/tmp/fastapi_ws_backplane.sock"),
+            high_water=int(os.getenv("WS_BACKPLANE_HIGH_WATER", str(8 * 1024 * 1024))),
+        )
+    if kind == "mqtt":
+        return MqttBackplane(
+            os.getenv("WS_BACKPLANE_MQTT_HOST", "127.0.0.1"),
+            int(os.getenv("WS_BACKPLANE_MQTT_PORT", "1883")),
+            os.getenv("WS_BACKPLANE_TOPIC", "fastapi/ws"),
+        )
+    return Backplane()
@@ -1,12 +1,26 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect, WebSocketException, status
-from fastapi.responses import HTMLResponse
+import os
+import io
+import csv
+import json
+import logging
+from typing import Any, Literal, Union
+from fastapi import APIRouter, Depends, Query, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect, WebSocketException, status
+from fastapi.responses import HTMLResponse, StreamingResponse
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 from hooks import easy, Adv, sqlClient, nosqlClient
-from Tasks.one import write_log, get_query
+from Tasks.one import write_log, get_query, send_email
+from Tasks.taskQueue import QueuedTasks, get_tasks, task_queue
+from two.wsManager import ConnectionManager, SampledLog
+from two.wsCodec import WsCodec, CODECS, DEFAULT_CODEC, FrameInvalid, FrameTooLarge, negotiate, offered_subprotocols
+from two.backplane import create_backplane
 
 
 router = APIRouter()
 
+# !每条消息都 print 太费 CPU，改成采样日志；用 uvicorn 配置好的 logger，默认 INFO 级别能直接输出
+ws_log = SampledLog(logging.getLogger("uvicorn.error"), int(os.getenv("WS_LOG_SAMPLE", "100")))
+
 
 """
 我们在这里使用钩子
@@ -42,7 +56,7 @@ async def read_items():
 # !使用数据库钩子，操作数据
 @router.get("/linkSQL")
 async def linksql():
-    # data = await sqlClient.get_db("insert into demo(username, password)values('NieBar', '123123123')")
+    # data = await sqlClient.get_db("insert into demo(username, password)values(:username, :password)", {"username": "NieBar", "password": "123123123"})
     data = await sqlClient.get_db("select * from demo")
     if data["status"] == 1:
         return HTMLResponse("<h1>%s</h1>" % data["data"].all(), status_code=200)
@@ -50,63 +64,129 @@ async def linksql():
         raise HTTPException(500, "database error")
 
 
+# !流式查询：服务端游标分批读，边读边发，首字节时间和内存都不随表变大
+async def ndjson_lines(rows_iter):
+    async for columns, rows in rows_iter:
+        yield "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + "\n" for row in rows)
+
+
+async def csv_lines(rows_iter):
+    header = False
+    async for columns, rows in rows_iter:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if not header:
+            writer.writerow(columns)
+            header = True
+        writer.writerows(rows)
+        yield buf.getvalue()
+
+
+@router.get("/linkSQL/stream")
+async def linksql_stream(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    chunk_size: int = Query(default=sqlClient.STREAM_CHUNK, ge=1, le=100000),
+):
+    rows_iter = sqlClient.stream_rows("select * from demo", chunk_size=chunk_size)
+    if format == "csv":
+        return StreamingResponse(csv_lines(rows_iter), media_type="text/csv")
+    return StreamingResponse(ndjson_lines(rows_iter), media_type="application/x-ndjson")
+
+
+# !写合并：同一时间的多个插入合成一条多行 insert，一个事务提交
+@router.post("/linkSQL")
+async def linksql_insert(username: str, password: str):
+    data = await sqlClient.write_db(
+        "insert into demo(username, password) values(:username, :password)",
+        {"username": username, "password": password},
+    )
+    if data["status"] == 1:
+        return {"message": "ok"}
+    raise HTTPException(400 if data["status"] == 0 else 500, "database error")
+
+
+# !查询缓存的命中率
+@router.get("/linkSQL/cache")
+async def linksql_cache():
+    return sqlClient.query_cache.stats() if sqlClient.query_cache is not None else {"enabled": False}
+
+
+# !会话钩子：每个请求从连接池借一个会话，参数化查询防注入
+@router.get("/linkSQL/{username}")
+async def linksql_user(username: str, session: AsyncSession = Depends(sqlClient.get_session)):
+    result = await session.execute(text("select * from demo where username = :username"), {"username": username})
+    return [dict(row) for row in result.mappings()]
+
+
 @router.post("/send-notification/{email}")
-async def send_notification(email: str, background_tasks: BackgroundTasks, q: str = Depends(get_query)):
+async def send_notification(
+    email: str,
+    background_tasks: BackgroundTasks,
+    tasks: QueuedTasks = Depends(get_tasks),
+    q: str = Depends(get_query),
+):
     message = f"message to {email}\n"
     background_tasks.add_task(write_log, message)
     # !支持多次任务
     # background_tasks.add_task(write_log, message)
+    # !发送放进持久化队列，由进程池执行，失败自动重试，重启也不会丢
+    tasks.add_task(send_email, email, message)
     return {"message": "Message sent"}
 
 
+# !任务队列的积压和执行情况
+@router.get("/tasks/stats")
+async def tasks_stats():
+    return await task_queue.stats()
+
+
 """
 websocket操作
 """
 
 
 # !有bug存在，/ws/ 和 /ws 是不同的表示
+# 按子协议协商消息编码，没有协商时返回 None
+async def get_codec(websocket: WebSocket) -> Union[WsCodec, None]:
+    return negotiate(offered_subprotocols(websocket))
+
+
 @router.websocket("/ws")
-async def websocket1(websocket: WebSocket):
-    await websocket.accept()
+async def websocket1(websocket: WebSocket, codec: Union[WsCodec, None] = Depends(get_codec)):
+    await websocket.accept(subprotocol=codec.name if codec is not None else None)
+    codec = codec or DEFAULT_CODEC
     while True:
         # 持续接收参数
-        data = await websocket.receive_text()
-        print("接收数据:", data)
-        await websocket.send_text(f"{data}")
-
-
-class ConnectionManager:
-    def __init__(self):
-        # websocket连接池
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket, token):
-        # 等待链接，由于存在token是以子协议的方式传递。我们也得走子协议
-        await websocket.accept(subprotocol=token)
-        # 将联入的客户端加入列表
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        # 删除客户端
-        self.active_connections.remove(websocket)
-
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        # 单一客户端发送
-        await websocket.send_text(message)
-
-    async def broadcast(self, message: str):
-        # 这里就是广播了，给所有客户端发送
-        for connection in self.active_connections:
-            await connection.send_text(message)
-
-
-manager = ConnectionManager()
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            break
+        try:
+            data = codec.decode(message)
+        except FrameTooLarge as e:
+            await websocket.close(code=status.WS_1009_MESSAGE_TOO_BIG, reason=str(e))
+            break
+        except FrameInvalid:
+            await websocket.close(code=status.WS_1007_INVALID_FRAME_PAYLOAD_DATA, reason="invalid frame payload")
+            break
+        ws_log.info("接收数据: %.200r", data)
+        await websocket.send(codec.frame(data))
+
+
+# !每个客户端独立的发送队列，慢客户端按策略丢消息或被踢掉
+manager = ConnectionManager(
+    queue_size=int(os.getenv("WS_QUEUE_SIZE", "100")),
+    policy=os.getenv("WS_SLOW_POLICY", "evict"),
+    send_timeout=float(os.getenv("WS_SEND_TIMEOUT", "5")),
+    # !多 worker 部署时用 WS_BACKPLANE=unix 或 mqtt，广播才能到达所有 worker 上的连接
+    backplane=create_backplane(),
+)
 
 
 # 加入钩子，验证token是否正确.
 async def get_cookie_or_token(websocket: WebSocket):
-    # 通过子协议头获取token
-    token = websocket.headers.get("sec-websocket-protocol")
+    # 通过子协议头获取token，编码名（json/msgpack/cbor...）不算 token
+    tokens = [item for item in offered_subprotocols(websocket) if item not in CODECS]
+    token = tokens[0] if tokens else None
 
     if token != "123":
         raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION)
@@ -114,14 +194,58 @@ async def get_cookie_or_token(websocket: WebSocket):
     return token
 
 
+def parse_command(data: Any) -> Union[dict, None]:
+    # 只有带 action 字段的 JSON 对象才算指令，其他内容还是普通聊天消息；二进制编码直接就是对象
+    if isinstance(data, str):
+        if not data.startswith("{"):
+            return None
+        try:
+            command = json.loads(data)
+        except ValueError:
+            return None
+    else:
+        command = data
+    if isinstance(command, dict) and "action" in command:
+        return command
+    return None
+
+
+async def room_command(websocket: WebSocket, client_id: int, command: dict):
+    action, room = command.get("action"), str(command.get("room", ""))
+    try:
+        if action == "join":
+            manager.join(websocket, room)
+            await manager.send_room(room, f"Client #{client_id} joined {room}")
+        elif action == "leave":
+            if manager.leave(websocket, room):
+                await manager.send_room(room, f"Client #{client_id} left {room}")
+        elif action == "send":
+            await manager.send_room(room, {"room": room, "from": client_id, "data": command.get("data")})
+        else:
+            await manager.send_personal_message({"error": f"unknown action: {action}"}, websocket)
+    except ValueError as e:
+        await manager.send_personal_message({"error": str(e)}, websocket)
+
+
 @router.websocket("/ws3/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: int, token: str = Depends(get_cookie_or_token)):
+async def websocket_endpoint(
+    websocket: WebSocket,
+    client_id: int,
+    token: str = Depends(get_cookie_or_token),
+    codec: Union[WsCodec, None] = Depends(get_codec),
+):
     # 开始接收链接
-    await manager.connect(websocket, token)
+    await manager.connect(websocket, token, codec)
     try:
         while True:
-            # 接收文本数据
-            data = await websocket.receive_text()
+            # 接收数据，按协商的编码解码
+            data = await manager.receive(websocket)
+            ws_log.info("Client #%s: %.200r", client_id, data)
+            # !房间指令：{"action": "join|leave", "room": "x"}，{"action": "send", "room": "x", "data": ...}
+            command = parse_command(data)
+            if command is not None:
+                await room_command(websocket, client_id, command)
+                continue
             # 单数据
             await manager.send_personal_message(f"You wrote: {data}", websocket)
             await manager.broadcast(f"Client #{client_id} says: {data}")
@@ -130,3 +254,8 @@ async def websocket_endpoint(websocket: WebSocket, client_id: int, token: str =
         manager.disconnect(websocket)
         # 谁出问题，谁挂断
         await manager.broadcast(f"Client #{client_id} left the chat")
+
+
+@router.get("/ws3/stats")
+async def websocket_stats():
+    return manager.stats()
@@ -0,0 +1,143 @@
+"""
+websocket 消息编码，通过子协议协商：json（默认）、msgpack、cbor，后缀 +deflate 开启压缩
+例如 new WebSocket(url, ["123", "msgpack+deflate"])，服务端选中的编码会作为子协议回给客户端
+
+开启 +deflate 后所有消息都是二进制帧，第一个字节 0 表示未压缩、1 表示 zlib 压缩，
+只有超过 WS_DEFLATE_MIN 字节的消息才会压缩，小消息压缩反而更费 CPU
+客户端发来的压缩帧解压后超过 WS_MAX_FRAME 字节直接拒绝，防止几 KB 的压缩包解出几个 G（解压炸弹）
+"""
+import json
+import os
+import zlib
+from typing import Any, Callable, Dict, List, Union
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # 可选依赖
+    cbor2 = None
+
+
+DEFLATE_SUFFIX = "+deflate"
+DEFLATE_MIN = int(os.getenv("WS_DEFLATE_MIN", "1024"))
+DEFLATE_LEVEL = int(os.getenv("WS_DEFLATE_LEVEL", "6"))
+MAX_FRAME = int(os.getenv("WS_MAX_FRAME", str(1024 * 1024)))
+FLAG_RAW = b"\x00"
+FLAG_DEFLATE = b"\x01"
+
+
+class FrameTooLarge(ValueError):
+    pass
+
+
+class FrameInvalid(ValueError):
+    # 解不开的帧：坏的 msgpack/cbor、损坏的压缩数据、非法 UTF-8 等
+    pass
+
+
+def inflate(data: bytes, limit: int = MAX_FRAME) -> bytes:
+    # !限制解压后的大小，超出上限（还有没解完的输入）就拒绝这一帧
+    inflater = zlib.decompressobj()
+    payload = inflater.decompress(data, limit)
+    if inflater.unconsumed_tail:
+        raise FrameTooLarge(f"frame exceeds {limit} bytes after decompression")
+    return payload
+
+
+class WsCodec:
+    def __init__(
+        self,
+        name: str,
+        dumps: Callable[[Any], bytes],
+        loads: Callable[[bytes], Any],
+        binary: bool,
+        deflate: bool = False,
+    ):
+        self.name = name + (DEFLATE_SUFFIX if deflate else "")
+        self.dumps = dumps
+        self.loads = loads
+        self.binary = binary
+        self.deflate = deflate
+        self.compressed = 0
+
+    def __repr__(self):
+        return f"WsCodec({self.name})"
+
+    def _pack(self, payload: bytes) -> bytes:
+        if len(payload) >= DEFLATE_MIN:
+            self.compressed += 1
+            return FLAG_DEFLATE + zlib.compress(payload, DEFLATE_LEVEL)
+        return FLAG_RAW + payload
+
+    def frame(self, message: Union[str, bytes, Any]) -> dict:
+        # 把消息编码成 ASGI 发送消息，同一编码的所有连接共用
+        if self.binary:
+            payload = self.dumps(message)
+        elif isinstance(message, bytes):
+            return {"type": "websocket.send", "bytes": self._pack(message) if self.deflate else message}
+        else:
+            text = message if isinstance(message, str) else json.dumps(message, ensure_ascii=False)
+            if not self.deflate:
+                return {"type": "websocket.send", "text": text}
+            payload = text.encode()
+        return {"type": "websocket.send", "bytes": self._pack(payload) if self.deflate else payload}
+
+    def decode(self, message: dict) -> Any:
+        # 解码客户端发来的消息；json 编码下文本原样返回，由调用方决定要不要解析
+        # 压缩帧解压后超过 MAX_FRAME 抛 FrameTooLarge，调用方应以 1009 关闭连接；
+        # 其他解不开的帧抛 FrameInvalid，调用方应以 1007 关闭连接
+        text = message.get("text")
+        if text is not None:
+            return text
+        data = message.get("bytes") or b""
+        try:
+            if self.deflate and data:
+                flag, data = data[:1], data[1:]
+                if flag == FLAG_DEFLATE:
+                    data = inflate(data)
+            if self.binary:
+                return self.loads(data)
+            return data.decode()
+        except FrameTooLarge:
+            raise
+        except Exception as e:
+            # 各编码库的异常类型不统一，统一转成 FrameInvalid
+            raise FrameInvalid(f"invalid {self.name} frame: {e}") from e
+
+
+def _codec_factories() -> Dict[str, Callable[[bool], WsCodec]]:
+    factories = {"json": lambda deflate: WsCodec("json", None, None, False, deflate)}
+    if msgpack is not None:
+        factories["msgpack"] = lambda deflate: WsCodec(
+            "msgpack", lambda m: msgpack.packb(m, use_bin_type=True), lambda b: msgpack.unpackb(b, raw=False), True, deflate
+        )
+    if cbor2 is not None:
+        factories["cbor"] = lambda deflate: WsCodec("cbor", cbor2.dumps, cbor2.loads, True, deflate)
+    return factories
+
+
+# !所有编码在进程内各只有一个实例，广播时按编码缓存编码结果
+CODECS: Dict[str, WsCodec] = {}
+for _name, _factory in _codec_factories().items():
+    CODECS[_name] = _factory(False)
+    CODECS[_name + DEFLATE_SUFFIX] = _factory(True)
+DEFAULT_CODEC = CODECS["json"]
+
+
+def offered_subprotocols(websocket) -> List[str]:
+    # 子协议头可能是 "123, msgpack+deflate" 这样的列表
+    header = websocket.headers.get("sec-websocket-protocol") or ""
+    return [item.strip() for item in header.split(",") if item.strip()]
+
+
+def negotiate(offered: List[str]) -> Union[WsCodec, None]:
+    # 按客户端给出的顺序选第一个支持的编码，没有则返回 None（按默认 json 处理）
+    for name in offered:
+        codec = CODECS.get(name)
+        if codec is not None:
+            return codec
+    return None
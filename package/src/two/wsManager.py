@@ -0,0 +1,243 @@
+"""
+websocket 连接管理
+每个客户端一个发送队列 + 一个写协程，广播只负责往队列里放消息，慢客户端不会拖住其他人
+"""
+import asyncio
+import logging
+import re
+from typing import Any, Dict, Literal, Set, Union
+from fastapi import WebSocket, WebSocketDisconnect, status
+from two.backplane import Backplane
+from two.wsCodec import WsCodec, CODECS, DEFAULT_CODEC, FrameInvalid, FrameTooLarge
+
+
+# 背板上的全员广播频道，房间频道为 room:<房间名>
+BROADCAST = "all"
+ROOM_PREFIX = "room:"
+# 房间名同时会成为 mqtt topic 的一段，不允许 / + # 等字符
+ROOM_NAME = re.compile(r"[\w\-.]{1,64}")
+
+
+def _check_room(room: str):
+    # 用 fullmatch，"$" 会放过结尾的换行
+    if not ROOM_NAME.fullmatch(room):
+        raise ValueError(f"房间名不合法：{room}")
+
+
+# !队列满了之后的策略：drop 丢弃新消息，dropOldest 丢弃最旧的消息，evict 直接踢掉这个慢客户端
+SlowPolicy = Literal["drop", "dropOldest", "evict"]
+
+
+class SampledLog:
+    """
+    热路径上的采样日志：第 1 条和之后每 every 条记一次，避免每条消息都打日志
+    """
+
+    def __init__(self, logger: logging.Logger, every: int = 100):
+        self.logger = logger
+        self.every = max(every, 1)
+        self.count = 0
+
+    def info(self, msg: str, *args):
+        self.count += 1
+        if self.count % self.every == 1 or self.every == 1:
+            self.logger.info(f"[{self.count}] " + msg, *args)
+
+
+class Client:
+    def __init__(self, websocket: WebSocket, queue_size: int, codec: WsCodec = DEFAULT_CODEC):
+        self.websocket = websocket
+        self.codec = codec
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.writer: Union[asyncio.Task, None] = None
+        self.sent = 0
+        self.dropped = 0
+        # 反向索引：这个连接加入了哪些房间，断开时只需遍历这里
+        self.rooms: Set[str] = set()
+
+
+class ConnectionManager:
+    def __init__(
+        self,
+        queue_size: int = 100,
+        policy: SlowPolicy = "evict",
+        send_timeout: float = 5,
+        backplane: Union[Backplane, None] = None,
+    ):
+        # websocket连接池，dict 做成员表，加入和删除都是 O(1)
+        self.active_connections: Dict[WebSocket, Client] = {}
+        self.queue_size = queue_size
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.evicted = 0
+        # 房间索引：房间名 -> 成员，给房间发消息只遍历成员
+        self.rooms: Dict[str, Set[Client]] = {}
+        # 多 worker 时把广播转给其他 worker，默认只在本进程广播
+        self.backplane = backplane or Backplane()
+
+    async def start(self):
+        await self.backplane.start(self.on_backplane)
+
+    async def stop(self):
+        await self.backplane.stop()
+        for websocket in list(self.active_connections):
+            self.disconnect(websocket)
+
+    async def connect(self, websocket: WebSocket, token, codec: Union[WsCodec, None] = None):
+        # 等待链接，由于存在token是以子协议的方式传递。我们也得走子协议；协商了编码时回编码名
+        await websocket.accept(subprotocol=codec.name if codec is not None else token)
+        # 将联入的客户端加入连接池，并启动它自己的写协程
+        client = Client(websocket, self.queue_size, codec or DEFAULT_CODEC)
+        client.writer = asyncio.create_task(self._writer(client))
+        self.active_connections[websocket] = client
+
+    def disconnect(self, websocket: WebSocket):
+        # 删除客户端，可以重复调用（被踢掉之后接收循环还会再调一次）
+        client = self.active_connections.pop(websocket, None)
+        if client is None:
+            return
+        self._leave_all(client)
+        if client.writer is not None:
+            client.writer.cancel()
+
+    def join(self, websocket: WebSocket, room: str) -> bool:
+        _check_room(room)
+        client = self.active_connections.get(websocket)
+        if client is None:
+            return False
+        self.rooms.setdefault(room, set()).add(client)
+        client.rooms.add(room)
+        return True
+
+    def leave(self, websocket: WebSocket, room: str) -> bool:
+        client = self.active_connections.get(websocket)
+        if client is None or room not in client.rooms:
+            return False
+        client.rooms.discard(room)
+        self._discard(room, client)
+        return True
+
+    def _discard(self, room: str, client: Client):
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(client)
+            # 空房间直接删掉，索引不会无限增长
+            if not members:
+                del self.rooms[room]
+
+    def _leave_all(self, client: Client):
+        for room in client.rooms:
+            self._discard(room, client)
+        client.rooms.clear()
+
+    async def receive(self, websocket: WebSocket) -> Any:
+        # 按连接协商的编码解码客户端消息，断开时抛 WebSocketDisconnect
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        client = self.active_connections.get(websocket)
+        try:
+            return (client.codec if client is not None else DEFAULT_CODEC).decode(message)
+        except FrameTooLarge as e:
+            # 解压后过大的帧按 1009 关闭，当作断开处理
+            await websocket.close(code=status.WS_1009_MESSAGE_TOO_BIG, reason=str(e))
+            raise WebSocketDisconnect(status.WS_1009_MESSAGE_TOO_BIG)
+        except FrameInvalid:
+            # 解不开的帧按 1007 关闭，同样当作断开处理，由调用方移出连接池和房间
+            await websocket.close(code=status.WS_1007_INVALID_FRAME_PAYLOAD_DATA, reason="invalid frame payload")
+            raise WebSocketDisconnect(status.WS_1007_INVALID_FRAME_PAYLOAD_DATA)
+
+    def _enqueue(self, client: Client, frame: dict):
+        try:
+            client.queue.put_nowait(frame)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.policy == "drop":
+            client.dropped += 1
+        elif self.policy == "dropOldest":
+            client.queue.get_nowait()
+            client.queue.put_nowait(frame)
+            client.dropped += 1
+        else:
+            self._evict(client, "send queue full")
+
+    def _evict(self, client: Client, reason: str):
+        # 踢掉慢客户端：移出连接池，后台关闭连接，不等待
+        if self.active_connections.pop(client.websocket, None) is None:
+            return
+        self._leave_all(client)
+        self.evicted += 1
+        asyncio.create_task(self._close(client, reason))
+
+    async def _close(self, client: Client, reason: str):
+        if client.writer is not None and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+        try:
+            await asyncio.wait_for(
+                client.websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason=reason),
+                self.send_timeout,
+            )
+        except Exception:
+            pass
+
+    async def _writer(self, client: Client):
+        send = client.websocket.send
+        while True:
+            frame = await client.queue.get()
+            try:
+                # *单次发送超时也算慢客户端
+                await asyncio.wait_for(send(frame), self.send_timeout)
+            except Exception:
+                self._evict(client, "send timeout")
+                return
+            client.sent += 1
+
+    async def send_personal_message(self, message: Union[str, bytes, Any], websocket: WebSocket):
+        # 单一客户端发送
+        client = self.active_connections.get(websocket)
+        if client is not None:
+            self._enqueue(client, client.codec.frame(message))
+
+    def _fanout(self, clients, message: Union[str, bytes, Any]):
+        # !每种编码只编码一次，同编码的客户端共用同一个 ASGI 消息
+        frames: Dict[WsCodec, dict] = {}
+        for client in list(clients):
+            frame = frames.get(client.codec)
+            if frame is None:
+                frame = frames[client.codec] = client.codec.frame(message)
+            self._enqueue(client, frame)
+
+    async def broadcast(self, message: Union[str, bytes, Any]):
+        # 这里就是广播了，只入队不等待发送，耗时只和连接数有关；其他 worker 经背板转发
+        self._fanout(self.active_connections.values(), message)
+        self.backplane.publish(BROADCAST, message)
+
+    async def send_room(self, room: str, message: Union[str, bytes, Any]):
+        # 只发给房间成员，其他 worker 上的成员经背板转发
+        _check_room(room)
+        self._fanout(self.rooms.get(room, ()), message)
+        self.backplane.publish(ROOM_PREFIX + room, message)
+
+    def on_backplane(self, channel: str, message: Union[str, bytes, Any]):
+        # 其他 worker 转来的消息只发给本进程的连接，不再转发
+        if channel == BROADCAST:
+            self._fanout(self.active_connections.values(), message)
+        elif channel.startswith(ROOM_PREFIX):
+            self._fanout(self.rooms.get(channel[len(ROOM_PREFIX) :], ()), message)
+
+    def stats(self) -> dict:
+        codecs: Dict[str, int] = {}
+        for client in self.active_connections.values():
+            codecs[client.codec.name] = codecs.get(client.codec.name, 0) + 1
+        return {
+            "codecs": codecs,
+            # 各 +deflate 编码实际压缩过的消息数
+            "compressed": {c.name: c.compressed for c in CODECS.values() if c.deflate},
+            "backplane": self.backplane.stats(),
+            "connections": len(self.active_connections),
+            "rooms": len(self.rooms),
+            "evicted": self.evicted,
+            "queued": sum(c.queue.qsize() for c in self.active_connections.values()),
+            "dropped": sum(c.dropped for c in self.active_connections.values()),
+        }
@@ -0,0 +1,27 @@
+from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
+from mqtt import mqttHandle
+from forward import forwardHandle
+from bridge import bridgeHandle
+from sockets import inputNet, outputNet, receQueue, responseQueue
+
+
+router = APIRouter()
+
+"""
+运行指标：队列深度、转发引擎等，用于观察背压
+"""
+
+
+@router.get("/")
+async def metrics():
+    return ORJSONResponse(
+        {
+            "mqtt": mqttHandle.stats(),
+            "forward": forwardHandle.stats(),
+            "bridge": bridgeHandle.stats(),
+            "queues": [receQueue.stats(), responseQueue.stats()],
+            "inputNet": {name: node.stats() for name, node in inputNet.items()},
+            "outputNet": {name: node.stats() for name, node in outputNet.items()},
+        }
+    )
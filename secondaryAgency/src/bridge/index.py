@@ -0,0 +1,299 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+"""
+协议桥接：把 socket 节点、mqtt topic、http 上游之间的消息按路由搬运
+每条路由有独立的有界队列、攒批参数、并发工作协程和吞吐统计
+
+source  input            输入节点汇总队列 receQueue
+        output           输出节点汇总队列 responseQueue
+        mqtt:<过滤器>    订阅该 topic 过滤器
+sinks   mqtt:<topic>     发布到 topic
+        http:<url>       POST 到上游，攒批时请求体为列表
+        input:<节点名>   经输入节点发出
+        output:<节点名>  经输出节点发出
+"""
+
+import asyncio
+import time
+import concurrent.futures
+from typing import Any, Dict, List, Optional, Tuple
+import orjson
+from loguru import logger
+from paho.mqtt.client import MQTTMessage
+from setting import settings, BridgeConfig, BridgeRouteConfig
+from mqtt import mqttHandle, Route
+from forward import forwardHandle
+from sockets import (
+    BoundedQueue,
+    ShmFrame,
+    inputNet,
+    outputNet,
+    receQueue,
+    responseQueue,
+    releaseDropped,
+)
+
+SOURCE_KINDS = ("input", "output", "mqtt")
+SINK_KINDS = ("mqtt", "http", "input", "output")
+
+
+def _split(spec: str) -> Tuple[str, str]:
+    kind, _, target = spec.partition(":")
+    return kind, target
+
+
+def _fromBytes(data: bytes) -> Any:
+    # 能解析成 JSON 就按对象流转，否则保留原始 bytes
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return data
+
+
+def _toPayload(item: Any) -> bytes | str:
+    if isinstance(item, (bytes, str)):
+        return item
+    if isinstance(item, (bytearray, memoryview)):
+        return bytes(item)
+    return orjson.dumps(item)
+
+
+def _toJson(item: Any) -> Any:
+    if isinstance(item, (bytes, bytearray, memoryview)):
+        return bytes(item).decode(errors="replace")
+    return item
+
+
+class BridgeRoute(object):
+    def __init__(self, config: BridgeRouteConfig):
+        self.config = config
+        self.name = config.name
+        kind, self.filter = _split(config.source)
+        if kind not in SOURCE_KINDS or (kind == "mqtt" and not self.filter):
+            raise ValueError(f"桥接路由 {self.name} 的来源无效：{config.source}")
+        self.source = kind
+        self.sinks: List[Tuple[str, str]] = []
+        for spec in config.sinks:
+            sink = _split(spec)
+            self._checkSink(sink, spec)
+            self.sinks.append(sink)
+        if not self.sinks:
+            raise ValueError(f"桥接路由 {self.name} 没有配置去向")
+        self.queue = BoundedQueue(
+            config.queueSize, "block", onDrop=releaseDropped, name=f"bridge-{self.name}"
+        )
+        self.workers: List[asyncio.Task] = []
+        self.mqttRoute: Optional[Route] = None
+        # 统计
+        self.received = 0
+        self.delivered = 0
+        self.batches = 0
+        self.errors = 0
+        self.rate = 0.0
+        self.windowStart = time.monotonic()
+        self.windowCount = 0
+
+    def _checkSink(self, sink: Tuple[str, str], spec: str):
+        kind, target = sink
+        if kind not in SINK_KINDS or not target:
+            raise ValueError(f"桥接路由 {self.name} 的去向无效：{spec}")
+        nodes = {"input": inputNet, "output": outputNet}.get(kind)
+        if nodes is not None and target not in nodes:
+            raise ValueError(f"桥接路由 {self.name} 引用了不存在的节点：{spec}")
+
+    def count(self, n: int):
+        """
+        每秒滚动一次吞吐，统计本身不额外开任务
+        """
+        self.delivered += n
+        self.windowCount += n
+        now = time.monotonic()
+        elapsed = now - self.windowStart
+        if elapsed >= 1:
+            self.rate = self.windowCount / elapsed
+            self.windowStart = now
+            self.windowCount = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "source": self.config.source,
+            "sinks": self.config.sinks,
+            "workers": len(self.workers),
+            "received": self.received,
+            "delivered": self.delivered,
+            "batches": self.batches,
+            "errors": self.errors,
+            "rate": round(self.rate, 2),
+            "queue": self.queue.stats(),
+        }
+
+
+class BridgeService(object):
+    def __init__(self, config: BridgeConfig, drainTimeout: float = 5):
+        self.config = config
+        self.drainTimeout = drainTimeout
+        self.routes: List[BridgeRoute] = []
+        self.pumps: List[asyncio.Task] = []
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stopping = False
+
+    async def start(self):
+        """
+        在 mqtt 启动之前调用，mqtt 来源的订阅随首次连接一起下发
+        """
+        self.loop = asyncio.get_running_loop()
+        self.stopping = False
+        self.routes = [BridgeRoute(cfg) for cfg in self.config.routes]
+        bySource: Dict[str, List[BridgeRoute]] = {}
+        for route in self.routes:
+            if route.source == "mqtt":
+                route.mqttRoute = mqttHandle.route(
+                    route.filter, [self._mqttHandler(route)]
+                )
+                mqttHandle.addSubscription(route.filter)
+            else:
+                bySource.setdefault(route.source, []).append(route)
+            for _ in range(route.config.workers):
+                route.workers.append(asyncio.create_task(self.worker(route)))
+        queues = {"input": receQueue, "output": responseQueue}
+        for source, routes in bySource.items():
+            self.pumps.append(asyncio.create_task(self.pump(queues[source], routes)))
+        if self.routes:
+            logger.info(f"协议桥接启动，路由：{[r.name for r in self.routes]}")
+
+    async def pump(self, queue: asyncio.Queue, routes: List[BridgeRoute]):
+        """
+        把节点汇总队列的消息分发给订阅它的所有路由；共享内存帧先拷出再归还槽位
+        """
+        while True:
+            item = await queue.get()
+            try:
+                if isinstance(item, ShmFrame):
+                    with item:
+                        item = bytes(item.view)
+                for route in routes:
+                    route.received += 1
+                    await route.queue.put(item)
+            finally:
+                queue.task_done()
+
+    def _mqttHandler(self, route: BridgeRoute):
+        """
+        在 mqtt 分发器的工作线程中执行；路由队列满时阻塞该线程，背压传回 broker 侧
+        """
+
+        def handler(client, userdata, msg: MQTTMessage):
+            if self.stopping:
+                return
+            item = _fromBytes(msg.payload)
+            fut = asyncio.run_coroutine_threadsafe(route.queue.put(item), self.loop)
+            while True:
+                try:
+                    fut.result(1)
+                    route.received += 1
+                    return
+                except concurrent.futures.TimeoutError:
+                    # 关闭期间不再等待，避免卡住分发器线程的 join
+                    if self.stopping:
+                        fut.cancel()
+                        logger.warning(f"桥接路由 {route.name} 关闭中，丢弃 {msg.topic}")
+                        return
+
+        handler.__name__ = f"bridge:{route.name}"
+        return handler
+
+    async def collect(self, route: BridgeRoute) -> List[Any]:
+        """
+        取一批消息：先阻塞等第一条，再在 batchInterval 内尽量凑满 batchSize
+        """
+        q = route.queue
+        batch = [await q.get()]
+        size = route.config.batchSize
+        if size <= 1:
+            return batch
+        deadline = self.loop.time() + route.config.batchInterval
+        while len(batch) < size:
+            try:
+                batch.append(q.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                break
+            try:
+                async with asyncio.timeout(remaining):
+                    batch.append(await q.get())
+            except TimeoutError:
+                break
+        return batch
+
+    async def worker(self, route: BridgeRoute):
+        while True:
+            batch = await self.collect(route)
+            try:
+                results = await asyncio.gather(
+                    *(self.deliver(sink, batch, route) for sink in route.sinks),
+                    return_exceptions=True,
+                )
+                for sink, res in zip(route.sinks, results):
+                    if isinstance(res, Exception):
+                        route.errors += 1
+                        logger.error(f"桥接路由 {route.name} 投递 {sink[0]}:{sink[1]} 失败：{res!r}")
+                route.batches += 1
+                route.count(len(batch))
+            finally:
+                for _ in batch:
+                    route.queue.task_done()
+
+    async def deliver(self, sink: Tuple[str, str], batch: List[Any], route: BridgeRoute):
+        kind, target = sink
+        if kind == "http":
+            body = _toJson(batch[0]) if route.config.batchSize <= 1 else [_toJson(i) for i in batch]
+            await forwardHandle.request("POST", target, body)
+        elif kind == "mqtt":
+            # 不逐条等确认，整批发出后统一等待，在途数量仍受发布窗口限制
+            futs = [
+                await mqttHandle.publish(target, _toPayload(item), wait=False)
+                for item in batch
+            ]
+            await asyncio.gather(*futs)
+        else:
+            node = (inputNet if kind == "input" else outputNet)[target]
+            for item in batch:
+                await node.sendMsg(item)
+
+    async def stop(self):
+        """
+        停止接收新消息，在 drainTimeout 内尽量投递完已排队的消息
+        """
+        self.stopping = True
+        for task in self.pumps:
+            task.cancel()
+        await asyncio.gather(*self.pumps, return_exceptions=True)
+        self.pumps.clear()
+        for route in self.routes:
+            if route.mqttRoute is not None:
+                mqttHandle.unRoute(route.filter, route.mqttRoute)
+        try:
+            async with asyncio.timeout(self.drainTimeout):
+                await asyncio.gather(*(r.queue.join() for r in self.routes))
+        except TimeoutError:
+            logger.warning("协议桥接关闭时仍有未投递的消息")
+        workers = [t for r in self.routes for t in r.workers]
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for route in self.routes:
+            route.workers.clear()
+        if self.routes:
+            logger.info("协议桥接关闭")
+
+    def stats(self) -> Dict[str, Any]:
+        return {route.name: route.stats() for route in self.routes}
+
+
+# 单例
+bridgeHandle = BridgeService(settings.bridge)
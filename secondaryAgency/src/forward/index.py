@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+"""
+异步 http 转发引擎，按上游 host 复用 keep-alive 长连接
+"""
+
+import asyncio
+from concurrent.futures import Future
+from typing import Any, Coroutine, Dict, Optional
+import aiohttp
+import orjson
+from loguru import logger
+from setting import settings, ForwardConfig
+
+
+def _jsonDumps(obj: Any) -> str:
+    return orjson.dumps(obj).decode()
+
+
+class ForwardService:
+    # 方法名 -> 参数放置位置，与原 requests 写法保持一致
+    METHODS = {
+        "POST": "json",
+        "GET": "params",
+        "PUT": "json",
+        "DELETE": "params",
+        "PATCH": "json",
+    }
+
+    def __init__(self, config: ForwardConfig):
+        self.config = config
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.inflight = 0
+        self.total = 0
+        self.errors = 0
+
+    async def start(self):
+        """
+        必须在事件循环内启动，连接池与该循环绑定
+        """
+        self.loop = asyncio.get_running_loop()
+        connector = aiohttp.TCPConnector(
+            limit=self.config.poolSize,
+            limit_per_host=self.config.poolSizePerHost,
+            keepalive_timeout=self.config.keepaliveTimeout,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=self.config.totalTimeout,
+            connect=self.config.connectTimeout,
+            sock_read=self.config.readTimeout,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector, timeout=timeout, json_serialize=_jsonDumps
+        )
+        logger.info(
+            f"转发引擎启动 poolSize={self.config.poolSize} poolSizePerHost={self.config.poolSizePerHost}"
+        )
+
+    def submit(self, coro: Coroutine) -> Future:
+        """
+        线程安全：其他线程（如 paho 网络线程）把协程交给转发引擎所在的事件循环
+        """
+        if self.loop is None or self.loop.is_closed():
+            coro.close()
+            raise RuntimeError("转发引擎未启动")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def request(self, method: str, url: str, data: Any = None) -> Any:
+        """
+        发起转发请求，返回 JSON 解析结果；无法解析时返回 {"error": 响应文本}
+        HTTP 4xx/5xx 抛出 aiohttp.ClientResponseError
+        """
+        if self.session is None:
+            raise RuntimeError("转发引擎未启动")
+        if url == "" or method == "":
+            raise ValueError("缺少必填字段（url/method）")
+        method = method.upper()
+        where = self.METHODS.get(method)
+        if where is None:
+            raise ValueError(
+                f"不支持的 HTTP 方法：{method}，支持的方法：POST/GET/PUT/DELETE/PATCH"
+            )
+
+        kwargs: Dict[str, Any] = {where: data if data is not None else {}}
+        self.inflight += 1
+        self.total += 1
+        try:
+            async with self.session.request(method, url, **kwargs) as res:
+                res.raise_for_status()
+                body = await res.read()
+            try:
+                return orjson.loads(body)
+            except orjson.JSONDecodeError:
+                return {"error": body.decode(errors="replace")}
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.inflight -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"inflight": self.inflight, "total": self.total, "errors": self.errors}
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        logger.info("转发引擎关闭")
+
+
+# 单例
+forwardHandle = ForwardService(settings.forward)
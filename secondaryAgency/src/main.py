@@ -10,7 +10,9 @@ from pathlib import Path
 from contextlib import asynccontextmanager
 from routers import index
 from mqtt import mqttHandle
-from sockets import inputNet, outputNet
+from forward import forwardHandle
+from sockets import startNodes, stopNodes
+from bridge import bridgeHandle
 from setting import settings
 
 
@@ -28,6 +30,11 @@ logger.add(
 
 
 async def startup():
+    # 转发引擎需先于 MQTT 启动，消息回调会直接把任务交给它
+    await forwardHandle.start()
+    await startNodes()
+    # 桥接路由先于 MQTT 绑定，mqtt 来源的订阅随首次连接下发
+    await bridgeHandle.start()
     tasks = [mqttHandle.start()]
     if tasks:
         await asyncio.gather(*tasks)
@@ -35,7 +42,11 @@ async def startup():
 
 async def shutdown():
     tasks = []
+    # 先停桥接（停止接收并投递完队列），再依次关闭各协议
+    await bridgeHandle.stop()
     mqttHandle.close()
+    await stopNodes()
+    await forwardHandle.close()
     logger.complete()
     if tasks:
         await asyncio.gather(*tasks)
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+"""
+mqtt 消息分发器：把回调从 paho 网络线程挪到有界工作线程池
+同一个 key（默认 topic）固定落在同一个工作线程，保证顺序；不同 key 并行
+"""
+
+import queue
+import threading
+from typing import Any, Callable, Dict, Hashable, List
+from loguru import logger
+
+
+class TopicDispatcher:
+    def __init__(self, workers: int = 4, queueSize: int = 1000):
+        self.workers = workers
+        self.queueSize = queueSize
+        self.queues: List[queue.Queue] = [
+            queue.Queue(maxsize=queueSize) for _ in range(workers)
+        ]
+        self.threads: List[threading.Thread] = []
+        self.processed = [0] * workers
+        self.errors = 0
+        # 队列满导致 paho 线程被阻塞的次数，反映背压
+        self.blocked = 0
+
+    def start(self):
+        if self.threads:
+            return
+        for i, q in enumerate(self.queues):
+            t = threading.Thread(
+                target=self._worker, args=(i, q), name=f"mqtt-dispatch-{i}", daemon=True
+            )
+            t.start()
+            self.threads.append(t)
+        logger.info(
+            f"mqtt 分发器启动 workers={self.workers} queueSize={self.queueSize}"
+        )
+
+    def _worker(self, index: int, q: queue.Queue):
+        while True:
+            item = q.get()
+            try:
+                if item is None:
+                    break
+                fn, args = item
+                fn(*args)
+            except Exception:
+                self.errors += 1
+                logger.exception(f"[mqtt-dispatch-{index}] 回调执行失败")
+            finally:
+                if item is not None:
+                    self.processed[index] += 1
+                q.task_done()
+
+    def dispatch(self, key: Hashable, fn: Callable, *args: Any):
+        """
+        按 key 分片投递；队列满时阻塞调用方（paho 网络线程），把背压传回 broker
+        """
+        q = self.queues[hash(key) % self.workers]
+        item = (fn, args)
+        try:
+            q.put_nowait(item)
+        except queue.Full:
+            self.blocked += 1
+            q.put(item)
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "capacity": self.workers * self.queueSize,
+            "depth": self.depth(),
+            "depthPerWorker": [q.qsize() for q in self.queues],
+            "processed": sum(self.processed),
+            "errors": self.errors,
+            "blocked": self.blocked,
+        }
+
+    def stop(self, timeout: float = 5):
+        """
+        等待已入队的消息处理完后退出
+        """
+        for q in self.queues:
+            try:
+                q.put(None, timeout=timeout)
+            except queue.Full:
+                logger.warning("mqtt 分发器队列已满，放弃剩余消息")
+        for t in self.threads:
+            t.join(timeout)
+        self.threads = []
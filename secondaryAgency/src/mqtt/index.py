@@ -3,20 +3,27 @@
 from idna import decode, encode
 from tools import crateRandomId
 import asyncio
-from typing import List, Union
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Union
 from paho.mqtt.client import (
     Client,
     MQTTv5,
     CallbackAPIVersion,
     Properties,
     MQTTMessage,
+    MQTTMessageInfo,
     SubscribeOptions,
 )
 from paho.mqtt.reasoncodes import ReasonCode as rc
 from loguru import logger
 from setting import settings
+from .dispatcher import TopicDispatcher
+from .router import TopicTrie, Route
+from .publisher import AsyncPublisher, PublishError
+from .rpc import RpcClient, RpcTimeout
+from paho.mqtt.packettypes import PacketTypes
 
 PayloadType = Union[str, bytes, bytearray, int, float, None]
+HandlerType = Callable[[Client, Any, MQTTMessage], Any]
 
 
 class MqttService:
@@ -27,22 +34,47 @@ class MqttService:
         username: str = None,
         password: str = None,
         client_id: str = "fastapi-mqtt-client",
+        dispatchWorkers: int = 4,
+        dispatchQueueSize: int = 1000,
+        shareGroup: Optional[str] = None,
+        publishWindow: int = 100,
+        publishBatchSize: int = 1,
+        publishBatchInterval: float = 0.002,
+        rpcReplyPrefix: str = "secondaryAgency/rpc",
+        rpcTimeout: float = 10,
     ):
         self.host = host
         self.port = port
         self.username = username
         self.password = password
         self.client_id = client_id
+        # 共享订阅组，非空时初始订阅走 $share/<group>/<topic>，由 broker 在多个进程间负载均衡
+        self.shareGroup = shareGroup
         self.client = Client(
             callback_api_version=CallbackAPIVersion.VERSION2,
             client_id=client_id,
             protocol=MQTTv5,
         )
+        self.dispatcher = TopicDispatcher(dispatchWorkers, dispatchQueueSize)
+        self.publisher = AsyncPublisher(
+            self.client, publishWindow, publishBatchSize, publishBatchInterval
+        )
+        # 回复 topic 按 client_id 独占，不走共享订阅
+        self.rpc = RpcClient(
+            self.publisher, f"{rpcReplyPrefix}/{client_id}/reply", rpcTimeout
+        )
+        # 处理器注册表（名称 -> 处理器）与 topic 路由
+        self.handlers: Dict[str, HandlerType] = {}
+        self.router = TopicTrie()
+        self.routesBound = False
+        # 运行中追加的订阅（如桥接路由），重连后与初始订阅一起恢复
+        self.extraTopics: List[str] = []
 
         self.client.username_pw_set(username, password)
         self.client.on_connect = self.connect_callback
         self.client.on_disconnect = self.disconnect_callback
         self.client.on_message = self.message_callback
+        self.client.on_publish = self.publisher.onPublish
         # self.client.on_subscribe = self.subscribe_callback
 
     def subscribe_callback(
@@ -52,9 +84,29 @@ class MqttService:
 
     def message_callback(self, client, userdata, msg: MQTTMessage):
         """
-        收集未被订阅的topic，打印到log中
+        按 topic 路由到处理器流水线，收集未被订阅的topic，打印到log中
+        """
+        if msg.topic == self.rpc.replyTopic:
+            self.rpc.onReply(msg)
+            return
+        routes: List[Route] = self.router.match(msg.topic)
+        if not routes:
+            logger.info(f"收集未被订阅 topic[{msg.topic}]: {msg.payload.decode()}")
+            return
+        for route in routes:
+            k = route.key(msg) if route.key else msg.topic
+            self.dispatcher.dispatch(
+                k, self.runPipeline, route, client, userdata, msg
+            )
+
+    @staticmethod
+    def runPipeline(route: Route, client, userdata, msg: MQTTMessage):
+        """
+        依次执行流水线中的处理器，某一步返回 False 时终止
         """
-        logger.info(f"收集未被订阅 topic[{msg.topic}]: {msg.payload.decode()}")
+        for fn in route.pipeline:
+            if fn(client, userdata, msg) is False:
+                break
 
     def disconnect_callback(self, client, userdata, flags, reason_code, properties):
         logger.error(f"MQTT connection failed! Reason: {reason_code}")
@@ -71,15 +123,108 @@ class MqttService:
             logger.error(f"MQTT connection failed! Reason: {reason_code}")
         else:
             logger.info("MQTT connection successful.")
+            # 每次（重）连成功后重新订阅，保证订阅在 broker 侧一直有效
+            self.initSub()
+
+    def handler(self, name: Optional[str] = None):
+        """
+        注册具名处理器，供配置中的流水线按名称引用
+        """
+
+        def decorator(fn: HandlerType):
+            self.handlers[name or fn.__name__] = fn
+            return fn
+
+        return decorator
+
+    def route(
+        self,
+        topicFilter: str,
+        pipeline: Sequence[str | HandlerType],
+        key: Optional[Callable[[MQTTMessage], Hashable]] = None,
+    ) -> Route:
+        """
+        把 topic 过滤器绑定到处理器流水线，流水线在分发器的工作线程中执行
+        key: 从消息中取顺序键，默认按 topic 保序
+        """
+        steps = []
+        for step in pipeline:
+            if isinstance(step, str):
+                if step not in self.handlers:
+                    raise KeyError(f"未注册的 mqtt 处理器：{step}")
+                step = self.handlers[step]
+            steps.append(step)
+        r = Route(topicFilter, tuple(steps), key)
+        self.router.insert(topicFilter, r)
+        logger.info(f"mqtt 路由绑定 {r}")
+        return r
+
+    def unRoute(self, topicFilter: str, route: Optional[Route] = None) -> int:
+        return self.router.remove(topicFilter, route)
+
+    def topicCallback(
+        self, topic: str, key: Optional[Callable[[MQTTMessage], Hashable]] = None
+    ):
+        """
+        直接把单个回调绑定到 topic
+        """
+
+        def decorator(fn: HandlerType):
+            self.route(topic, [fn], key)
+            return fn
+
+        return decorator
+
+    def bindRoutes(self):
+        """
+        按配置把每个订阅 topic 绑定到对应的处理器流水线
+        """
+        if self.routesBound:
+            return
+        for topic in settings.aimaster.subscribeTopic or []:
+            pipeline = settings.aimaster.handlers.get(
+                topic, settings.aimaster.defaultPipeline
+            )
+            self.route(topic, pipeline)
+        self.routesBound = True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connected": self.client.is_connected(),
+            "routes": len(self.router),
+            "publisher": self.publisher.stats(),
+            "rpc": self.rpc.stats(),
+            "dispatcher": self.dispatcher.stats(),
+        }
+
+    def shareTopic(self, topic: str) -> str:
+        """
+        共享订阅模式下，把 topic 转为 $share/<group>/<topic>
+        """
+        if not self.shareGroup:
+            return topic
+        return f"$share/{self.shareGroup}/{topic}"
 
     def initSub(self):
         # 订阅初始的主题
-        logger.info(
-            f"Initialize the subscription topic: {settings.aimaster.subscribeTopic}",
-        )
-        topics = list(map(lambda topic: (topic, 0), settings.aimaster.subscribeTopic))
+        topics = [
+            (self.shareTopic(topic), 0) for topic in settings.aimaster.subscribeTopic
+        ]
+        topics += [(self.shareTopic(topic), 0) for topic in self.extraTopics]
+        topics.append((self.rpc.replyTopic, 0))
+        logger.info(f"Initialize the subscription topic: {topics}")
         self.subTopic(topics)
 
+    def addSubscription(self, topic: str):
+        """
+        追加订阅，已连接时立即订阅，之后每次重连自动恢复
+        """
+        if topic in self.extraTopics:
+            return
+        self.extraTopics.append(topic)
+        if self.client.is_connected():
+            self.subTopic([(self.shareTopic(topic), 0)])
+
     def sendMsg(
         self,
         topic: str,
@@ -87,8 +232,65 @@ class MqttService:
         qos: int = 0,
         retain: bool = False,
         properties: Properties | None = None,
-    ):
-        self.client.publish(topic, payload, qos, retain, properties)
+    ) -> MQTTMessageInfo:
+        """
+        同步发布，可在 paho 回调/工作线程中直接调用
+        """
+        return self.client.publish(topic, payload, qos, retain, properties)
+
+    async def publish(
+        self,
+        topic: str,
+        payload: PayloadType = None,
+        qos: int = 0,
+        retain: bool = False,
+        properties: Properties | None = None,
+        wait: bool = True,
+    ) -> MQTTMessageInfo | asyncio.Future:
+        """
+        异步发布，受在途窗口限制；wait=False 时返回确认用的 Future
+        """
+        return await self.publisher.publish(
+            topic, payload, qos, retain, properties, wait
+        )
+
+    async def request(
+        self,
+        topic: str,
+        payload: PayloadType = None,
+        timeout: Optional[float] = None,
+        qos: int = 0,
+    ) -> MQTTMessage:
+        """
+        mqtt 请求响应，多个请求复用同一连接和同一个回复 topic
+        """
+        return await self.rpc.request(topic, payload, timeout, qos)
+
+    @staticmethod
+    def replyTarget(msg: MQTTMessage) -> tuple[Optional[str], Optional[bytes]]:
+        """
+        取请求方携带的 ResponseTopic 与 CorrelationData
+        """
+        props = msg.properties
+        return (
+            getattr(props, "ResponseTopic", None),
+            getattr(props, "CorrelationData", None),
+        )
+
+    def reply(
+        self,
+        responseTopic: str,
+        correlationData: Optional[bytes],
+        payload: PayloadType = None,
+        qos: int = 0,
+    ) -> MQTTMessageInfo:
+        """
+        按请求方的 ResponseTopic 回复，并带回 CorrelationData
+        """
+        props = Properties(PacketTypes.PUBLISH)
+        if correlationData is not None:
+            props.CorrelationData = correlationData
+        return self.sendMsg(responseTopic, payload, qos, False, props)
 
     def subTopic(
         self,
@@ -109,14 +311,17 @@ class MqttService:
         self.client.subscribe(topic)
 
     async def start(self):
+        self.bindRoutes()
+        self.dispatcher.start()
         self.client.connect_async(self.host, self.port)
         self.client.loop_start()
         await asyncio.sleep(0.01)
-        mqttHandle.initSub()
 
     def close(self):
+        self.publisher.close()
         self.client.loop_stop()
         self.client.disconnect()
+        self.dispatcher.stop()
 
 
 # 单例
@@ -126,4 +331,17 @@ mqttHandle = MqttService(
     username=settings.mqtt.username,
     password=settings.mqtt.password,
     client_id="secondaryAgency-" + crateRandomId(),
+    dispatchWorkers=settings.mqtt.dispatchWorkers,
+    dispatchQueueSize=settings.mqtt.dispatchQueueSize,
+    publishWindow=settings.mqtt.publishWindow,
+    publishBatchSize=settings.mqtt.publishBatchSize,
+    publishBatchInterval=settings.mqtt.publishBatchInterval,
+    rpcReplyPrefix=settings.mqtt.rpcReplyPrefix,
+    rpcTimeout=settings.mqtt.rpcTimeout,
+    # 多 worker 时每个进程都有自己的单例，必须走共享订阅，否则每条消息会被转发 N 次
+    shareGroup=(
+        settings.mqtt.shareGroup
+        if settings.mqtt.shareSubscribe or settings.secondary_agency.workers > 1
+        else None
+    ),
 )
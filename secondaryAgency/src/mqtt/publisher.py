@@ -0,0 +1,213 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+"""
+异步发布：把 paho 的 MQTTMessageInfo 转成可 await 的 Future
+支持在途窗口限流，以及把突发的小消息攒批后一次性交给 paho
+"""
+
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from paho.mqtt.client import (
+    Client,
+    MQTTMessageInfo,
+    MQTT_ERR_SUCCESS,
+    MQTT_ERR_NO_CONN,
+    Properties,
+)
+from paho.mqtt.reasoncodes import ReasonCode
+from loguru import logger
+
+
+class PublishError(Exception):
+    pass
+
+
+class AsyncPublisher:
+    def __init__(
+        self,
+        client: Client,
+        window: int = 100,
+        batchSize: int = 1,
+        batchInterval: float = 0.002,
+    ):
+        self.client = client
+        self.window = window
+        self.batchSize = batchSize
+        self.batchInterval = batchInterval
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        # mid -> Future，on_publish 在 paho 网络线程里回调
+        self.pending: Dict[int, Tuple[asyncio.Future, MQTTMessageInfo]] = {}
+        self.lock = threading.RLock()
+        # 正在调用 paho publish、还没登记 mid 的发布数
+        self.issuing = 0
+        self.early: Dict[int, ReasonCode] = {}
+        self.batch: List[Tuple[tuple, asyncio.Future]] = []
+        self.flushHandle: Optional[asyncio.TimerHandle] = None
+        self.published = 0
+        self.failed = 0
+        self.batches = 0
+        # qos>0 的在途上限与窗口保持一致
+        client.max_inflight_messages_set(window)
+
+    def _bind(self):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.semaphore = asyncio.Semaphore(self.window)
+
+    async def publish(
+        self,
+        topic: str,
+        payload: Any = None,
+        qos: int = 0,
+        retain: bool = False,
+        properties: Properties | None = None,
+        wait: bool = True,
+    ) -> MQTTMessageInfo | asyncio.Future:
+        """
+        wait=True：等到 broker 确认（qos0 为写出 socket）后返回 MQTTMessageInfo
+        wait=False：占到窗口后立即返回 Future，便于流水线式连续发布
+        """
+        self._bind()
+        await self.semaphore.acquire()
+        fut = self.loop.create_future()
+        fut.add_done_callback(self._release)
+        args = (topic, payload, qos, retain, properties)
+        if self.batchSize > 1:
+            self.batch.append((args, fut))
+            if len(self.batch) >= self.batchSize:
+                self.flush()
+            elif self.flushHandle is None:
+                self.flushHandle = self.loop.call_later(self.batchInterval, self.flush)
+        else:
+            self._issue([(args, fut)])
+        if wait:
+            return await fut
+        return fut
+
+    def flush(self):
+        """
+        把攒批的消息一次性交给 paho
+        """
+        if self.flushHandle is not None:
+            self.flushHandle.cancel()
+            self.flushHandle = None
+        batch, self.batch = self.batch, []
+        if batch:
+            self.batches += 1
+            self._issue(batch)
+
+    def _issue(self, items: List[Tuple[tuple, asyncio.Future]]):
+        for args, fut in items:
+            # !调用 paho publish 时不能持有 self.lock：publish 内部要拿 _out_message_mutex，
+            # 网络线程收到 PUBACK 时持有 _out_message_mutex 回调 onPublish，两边加锁顺序相反会死锁
+            with self.lock:
+                self.issuing += 1
+            try:
+                info = self.client.publish(*args)
+            except Exception as e:
+                self._registered()
+                fut.set_exception(e)
+                continue
+            qos = args[2]
+            if info.rc == MQTT_ERR_NO_CONN and qos > 0:
+                # 未连接时 qos>0 的消息由 paho 缓存，重连后补发
+                pass
+            elif info.rc != MQTT_ERR_SUCCESS:
+                self._registered()
+                fut.set_exception(PublishError(f"发布失败 rc={info.rc}"))
+                continue
+            # publish 返回前回调可能已经到了（同线程同步回调，或网络线程先收到确认），此时结果在 early 里
+            with self.lock:
+                if info.mid in self.early:
+                    entry = (fut, info, self.early.pop(info.mid))
+                else:
+                    entry = None
+                    self.pending[info.mid] = (fut, info)
+                self._registered()
+            if entry is not None:
+                self._resolve(*entry)
+
+    def _registered(self):
+        # 没有发布在登记途中时，early 里剩下的都是别处直接 client.publish 的 mid，清掉避免误匹配
+        with self.lock:
+            self.issuing -= 1
+            if self.issuing == 0:
+                self.early.clear()
+
+    def onPublish(self, client, userdata, mid, reason_code: ReasonCode, properties):
+        """
+        paho on_publish 回调（网络线程，持有 paho 的 _out_message_mutex）
+        """
+        with self.lock:
+            entry = self.pending.pop(mid, None)
+            if entry is None:
+                # Future 还没登记，先记下结果，由 _issue 登记时处理
+                if self.issuing:
+                    self.early[mid] = reason_code
+                return
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._resolve, *entry, reason_code)
+
+    @staticmethod
+    def _resolve(
+        fut: asyncio.Future, info: MQTTMessageInfo, reason_code: ReasonCode
+    ):
+        if fut.done():
+            return
+        if reason_code is not None and reason_code.is_failure:
+            fut.set_exception(PublishError(f"broker 拒绝发布：{reason_code}"))
+        else:
+            fut.set_result(info)
+
+    def _release(self, fut: asyncio.Future):
+        self.semaphore.release()
+        if fut.cancelled() or fut.exception() is not None:
+            self.failed += 1
+        else:
+            self.published += 1
+
+    def inflight(self) -> int:
+        return len(self.pending) + len(self.batch)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "window": self.window,
+            "inflight": self.inflight(),
+            "published": self.published,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+    def close(self):
+        """
+        连接关闭时让所有未确认的 Future 失败，避免调用方永远等待
+        """
+        if self.loop is None or self.loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._failAll()
+        else:
+            self.loop.call_soon_threadsafe(self._failAll)
+
+    def _failAll(self):
+        if self.flushHandle is not None:
+            self.flushHandle.cancel()
+            self.flushHandle = None
+        with self.lock:
+            futs = [fut for fut, _ in self.pending.values()]
+            futs += [fut for _, fut in self.batch]
+            self.pending.clear()
+            self.batch = []
+        for fut in futs:
+            if not fut.done():
+                fut.set_exception(PublishError("mqtt 连接已关闭"))
+        if futs:
+            logger.warning(f"mqtt 关闭，{len(futs)} 条消息未确认")
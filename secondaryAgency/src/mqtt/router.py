@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+"""
+topic 前缀树，支持 mqtt 通配符 + 和 #
+匹配耗时只与 topic 层级数有关，与注册的处理器数量无关
+"""
+
+from typing import Any, Dict, List
+
+
+class _TrieNode:
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.values: List[Any] = []
+
+
+class TopicTrie:
+    def __init__(self):
+        self.root = _TrieNode()
+        self.size = 0
+
+    @staticmethod
+    def validate(topicFilter: str):
+        levels = topicFilter.split("/")
+        for i, level in enumerate(levels):
+            if "#" in level and (level != "#" or i != len(levels) - 1):
+                raise ValueError(f"非法 topic 过滤器（# 只能单独出现在末尾）：{topicFilter}")
+            if "+" in level and level != "+":
+                raise ValueError(f"非法 topic 过滤器（+ 必须独占一层）：{topicFilter}")
+
+    def insert(self, topicFilter: str, value: Any):
+        self.validate(topicFilter)
+        node = self.root
+        for level in topicFilter.split("/"):
+            node = node.children.setdefault(level, _TrieNode())
+        node.values.append(value)
+        self.size += 1
+
+    def remove(self, topicFilter: str, value: Any = None) -> int:
+        """
+        移除过滤器上的值，value 为 None 时全部移除；返回移除数量
+        """
+        path = [self.root]
+        for level in topicFilter.split("/"):
+            node = path[-1].children.get(level)
+            if node is None:
+                return 0
+            path.append(node)
+        node = path[-1]
+        before = len(node.values)
+        node.values = [] if value is None else [v for v in node.values if v != value]
+        removed = before - len(node.values)
+        self.size -= removed
+        # 清理空分支
+        levels = topicFilter.split("/")
+        for i in range(len(levels), 0, -1):
+            child = path[i]
+            if child.values or child.children:
+                break
+            del path[i - 1].children[levels[i - 1]]
+        return removed
+
+    def match(self, topic: str) -> List[Any]:
+        levels = topic.split("/")
+        depth = len(levels)
+        # $ 开头的系统 topic 不参与首层通配符匹配
+        system = topic.startswith("$")
+        result: List[Any] = []
+        stack = [(self.root, 0)]
+        while stack:
+            node, i = stack.pop()
+            wildcard = not (system and i == 0)
+            if wildcard:
+                multi = node.children.get("#")
+                if multi is not None:
+                    # a/# 同时匹配 a 本身
+                    result.extend(multi.values)
+            if i == depth:
+                result.extend(node.values)
+                continue
+            child = node.children.get(levels[i])
+            if child is not None:
+                stack.append((child, i + 1))
+            if wildcard:
+                single = node.children.get("+")
+                if single is not None:
+                    stack.append((single, i + 1))
+        return result
+
+    def __len__(self):
+        return self.size
+
+
+class Route:
+    """
+    topic 过滤器绑定的处理器流水线
+    """
+
+    __slots__ = ("topicFilter", "pipeline", "key")
+
+    def __init__(self, topicFilter: str, pipeline: tuple, key=None):
+        self.topicFilter = topicFilter
+        self.pipeline = pipeline
+        self.key = key
+
+    def __repr__(self):
+        names = [getattr(fn, "__name__", repr(fn)) for fn in self.pipeline]
+        return f"Route({self.topicFilter!r}, {names})"
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+"""
+基于 MQTTv5 ResponseTopic / CorrelationData 的请求响应
+所有请求共用一个回复 topic，靠 CorrelationData 区分，可同时在途任意多个请求
+"""
+
+import asyncio
+import itertools
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional
+from paho.mqtt.client import MQTTMessage, Properties
+from paho.mqtt.packettypes import PacketTypes
+from loguru import logger
+
+if TYPE_CHECKING:
+    from .publisher import AsyncPublisher
+
+
+class RpcTimeout(asyncio.TimeoutError):
+    pass
+
+
+class RpcClient:
+    def __init__(
+        self, publisher: "AsyncPublisher", replyTopic: str, timeout: float = 10
+    ):
+        self.publisher = publisher
+        self.replyTopic = replyTopic
+        self.timeout = timeout
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.pending: Dict[bytes, asyncio.Future] = {}
+        self.lock = threading.Lock()
+        # 进程内随机前缀 + 自增序号，保证 CorrelationData 唯一
+        self.prefix = os.urandom(4)
+        self.counter = itertools.count()
+        self.requests = 0
+        self.timeouts = 0
+
+    async def request(
+        self,
+        topic: str,
+        payload: Any = None,
+        timeout: Optional[float] = None,
+        qos: int = 0,
+    ) -> MQTTMessage:
+        """
+        发送请求并等待回复，返回回复的 MQTTMessage；超时抛出 RpcTimeout
+        """
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        corr = self.prefix + next(self.counter).to_bytes(8, "big")
+        fut = self.loop.create_future()
+        # 先登记再发布，避免回复先于登记到达
+        with self.lock:
+            self.pending[corr] = fut
+        self.requests += 1
+
+        props = Properties(PacketTypes.PUBLISH)
+        props.ResponseTopic = self.replyTopic
+        props.CorrelationData = corr
+        try:
+            # 发布（断线或发布窗口满时会等待）和等回复共用同一个超时
+            return await asyncio.wait_for(
+                self._roundtrip(topic, payload, qos, props, fut),
+                self.timeout if timeout is None else timeout,
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise RpcTimeout(f"mqtt 请求超时 topic={topic}") from None
+        finally:
+            with self.lock:
+                self.pending.pop(corr, None)
+
+    async def _roundtrip(
+        self, topic: str, payload: Any, qos: int, props: Properties, fut: asyncio.Future
+    ) -> MQTTMessage:
+        # 占发布窗口这一步可以被超时取消；已经交给 paho 的消息不取消，窗口计数等 broker 确认后再释放
+        published = await self.publisher.publish(topic, payload, qos, False, props, wait=False)
+        await asyncio.shield(published)
+        return await fut
+
+    def onReply(self, msg: MQTTMessage):
+        """
+        paho 网络线程中调用，不经过分发器，直接唤醒等待方
+        """
+        corr = getattr(msg.properties, "CorrelationData", None)
+        with self.lock:
+            fut = self.pending.get(corr)
+        if fut is None:
+            logger.warning(f"mqtt 回复无匹配请求（可能已超时）topic={msg.topic}")
+            return
+        self.loop.call_soon_threadsafe(self._resolve, fut, msg)
+
+    @staticmethod
+    def _resolve(fut: asyncio.Future, msg: MQTTMessage):
+        if not fut.done():
+            fut.set_result(msg)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "inflight": len(self.pending),
+            "requests": self.requests,
+            "timeouts": self.timeouts,
+        }
@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from api import http, ws
+from api import http, ws, metrics
 from loguru import logger
 
 # 子路由
@@ -14,3 +14,4 @@ router = APIRouter(
 # 需要的接口
 router.include_router(http.router, prefix="/http", tags=["http"])
 router.include_router(ws.router, prefix="/ws", tags=["ws"])
+router.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
@@ -3,7 +3,7 @@
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field, BaseModel, field_validator
-from typing import Literal, List, Optional, Tuple
+from typing import Dict, Literal, List, Optional, Tuple
 from pathlib import Path
 
 # -------------------------- 路径配置 --------------------------
@@ -35,6 +35,14 @@ class AIMasterConfig(BaseModel):
         default=["demo"],
         description="AIMaster 相关的 MQTT 发布主题列表（.env 用逗号分隔）",
     )
+    handlers: Dict[str, List[str]] = Field(
+        default={},
+        description='订阅 topic 到处理器流水线的映射（.env 用 JSON，如 {"aimaster_send": ["shunt"]}）',
+    )
+    defaultPipeline: List[str] = Field(
+        default=["shunt"],
+        description="未在 handlers 中配置的订阅 topic 使用的处理器流水线",
+    )
 
     # 解析器：适配小驼峰字段名，将逗号分隔字符串转为列表
     @field_validator("subscribeTopic", "publishTopic", mode="before")
@@ -59,6 +67,158 @@ class MQTTConfig(BaseModel):
     port: int = Field(default=21883, description="MQTT 服务器端口")
     username: str = Field(default="admin", description="MQTT username")
     password: str = Field(default="deepSight123", description="MQTT password")
+    dispatchWorkers: int = Field(
+        default=4, ge=1, description="topic 回调工作线程数（并发上限）"
+    )
+    dispatchQueueSize: int = Field(
+        default=1000, ge=1, description="每个工作线程的队列长度，满了会阻塞 paho 线程"
+    )
+    publishWindow: int = Field(
+        default=100, ge=1, description="异步发布的在途消息窗口（未确认消息上限）"
+    )
+    publishBatchSize: int = Field(
+        default=1, ge=1, description="异步发布攒批条数，大于 1 时开启攒批"
+    )
+    publishBatchInterval: float = Field(
+        default=0.002, gt=0, description="攒批最长等待时间（秒）"
+    )
+    rpcReplyPrefix: str = Field(
+        default="secondaryAgency/rpc",
+        description="请求响应的回复 topic 前缀，实际为 <prefix>/<client_id>/reply",
+    )
+    rpcTimeout: float = Field(default=10, gt=0, description="请求响应默认超时（秒）")
+    shareSubscribe: bool = Field(
+        default=False,
+        description="是否使用 MQTTv5 共享订阅（workers > 1 时自动开启）",
+    )
+    shareGroup: str = Field(
+        default="secondaryAgency", description="共享订阅组名 $share/<group>/<topic>"
+    )
+
+    @field_validator("shareGroup")
+    def check_share_group(cls, value):
+        if not value or any(c in value for c in "/+#"):
+            raise ValueError("共享订阅组名不能为空，且不能包含 / + #")
+        return value
+
+
+class ForwardConfig(BaseModel):
+    poolSize: int = Field(default=100, ge=1, description="转发连接池总连接数上限")
+    poolSizePerHost: int = Field(
+        default=20, ge=0, description="单个上游 host 的连接数上限（0 为不限制）"
+    )
+    keepaliveTimeout: float = Field(
+        default=30, gt=0, description="空闲长连接保活时间（秒）"
+    )
+    connectTimeout: float = Field(default=10, gt=0, description="建立连接超时（秒）")
+    readTimeout: float = Field(default=60, gt=0, description="读取响应超时（秒）")
+    totalTimeout: float = Field(default=300, gt=0, description="单次请求总超时（秒）")
+
+
+class SocketNodeConfig(BaseModel):
+    transport: Literal["tcp", "shm"] = Field(
+        default="tcp", description="传输方式：tcp 或同机共享内存 shm"
+    )
+    host: str = Field(default="127.0.0.1", description="tcp 地址")
+    port: int = Field(default=0, ge=0, description="tcp 端口")
+    shmName: Optional[str] = Field(
+        default=None, description="共享内存名前缀，默认 secondaryAgency-<节点名>"
+    )
+    shmSlots: int = Field(default=32, ge=1, description="共享内存环形缓冲槽位数")
+    shmSlotSize: int = Field(
+        default=1024 * 1024, ge=1, description="共享内存单个槽位大小（字节），即单帧上限"
+    )
+    shmMaxPollInterval: float = Field(
+        default=0.02, gt=0, description="共享内存空闲时最长轮询间隔（秒），越大越省 CPU、空闲后首帧延迟越高"
+    )
+
+
+class SocketsConfig(BaseModel):
+    codec: Literal["json", "msgpack", "raw"] = Field(
+        default="json", description="socket 节点默认发送编码"
+    )
+    maxFrameSize: int = Field(
+        default=64 * 1024 * 1024, ge=1, description="单帧最大字节数，超出断开连接"
+    )
+    maxConnections: int = Field(
+        default=64, ge=1, description="每个服务端节点的最大连接数，超出直接拒绝"
+    )
+    idleTimeout: float = Field(
+        default=60, ge=0, description="读空闲超时（秒），超时断开，0 为不限制"
+    )
+    pingInterval: float = Field(
+        default=20, ge=0, description="心跳间隔（秒），0 为关闭心跳"
+    )
+    queueSize: int = Field(
+        default=10000, ge=1, description="receQueue/responseQueue 队列上限"
+    )
+    queuePolicy: Literal["block", "dropOldest", "dropNewest", "coalesce"] = Field(
+        default="block", description="receQueue/responseQueue 满了之后的策略"
+    )
+    sendQueueSize: int = Field(default=1000, ge=1, description="每个节点发送队列上限")
+    sendQueuePolicy: Literal["block", "dropOldest", "dropNewest"] = Field(
+        default="block", description="发送队列满了之后的策略"
+    )
+    writeFlushSize: int = Field(
+        default=64 * 1024, ge=1, description="合并写入的字节阈值，攒够即写出"
+    )
+    writeFlushInterval: float = Field(
+        default=0,
+        ge=0,
+        description="合并写入最长等待（秒），0 为只合并已排队的帧、不额外等待",
+    )
+    noDelay: bool = Field(
+        default=True, description="TCP_NODELAY，False 时交给内核 Nagle 算法合并小包"
+    )
+    connectTimeout: float = Field(
+        default=3, gt=0, description="客户端节点建立连接超时（秒）"
+    )
+    reconnectBaseDelay: float = Field(
+        default=0.05, gt=0, description="客户端节点重连退避的初始间隔（秒）"
+    )
+    reconnectMaxDelay: float = Field(
+        default=5, gt=0, description="客户端节点重连退避的最大间隔（秒）"
+    )
+    replayBufferSize: int = Field(
+        default=1000, ge=0, description="断线期间缓存待重发的帧数，超出丢弃最旧的"
+    )
+    coalesceKey: str = Field(
+        default="id", description="coalesce 策略下合并消息使用的字段"
+    )
+    highWatermark: float = Field(
+        default=0.8, gt=0, le=1, description="高水位（占上限比例），到达后暂停上游读取"
+    )
+    lowWatermark: float = Field(
+        default=0.5, ge=0, lt=1, description="低水位（占上限比例），回落后恢复上游读取"
+    )
+    inputNet: Dict[str, SocketNodeConfig] = Field(
+        default={"vision": SocketNodeConfig(port=60001)},
+        description="输入节点（本服务作为服务端），.env 用 JSON",
+    )
+    outputNet: Dict[str, SocketNodeConfig] = Field(
+        default={"talk": SocketNodeConfig(port=50001)},
+        description="输出节点（本服务作为客户端），.env 用 JSON",
+    )
+
+
+class BridgeRouteConfig(BaseModel):
+    name: str = Field(description="路由名称")
+    source: str = Field(
+        description="消息来源：input（输入节点）、output（输出节点）、mqtt:<topic 过滤器>"
+    )
+    sinks: List[str] = Field(
+        description="消息去向：mqtt:<topic>、http:<url>（POST）、input:<节点名>、output:<节点名>"
+    )
+    batchSize: int = Field(default=1, ge=1, description="攒批条数，大于 1 时去向收到列表")
+    batchInterval: float = Field(default=0.01, gt=0, description="攒批最长等待（秒）")
+    workers: int = Field(default=1, ge=1, description="该路由的并发工作协程数")
+    queueSize: int = Field(default=1000, ge=1, description="该路由的待处理队列上限")
+
+
+class BridgeConfig(BaseModel):
+    routes: List[BridgeRouteConfig] = Field(
+        default=[], description="协议桥接路由（.env 用 JSON 数组）"
+    )
 
 
 class SecondaryAgencyConfig(BaseModel):
@@ -75,6 +235,9 @@ class SecondaryAgencyConfig(BaseModel):
 class Settings(BaseSettings):
     aimaster: AIMasterConfig = Field(default_factory=AIMasterConfig)
     mqtt: MQTTConfig = Field(default_factory=MQTTConfig)
+    forward: ForwardConfig = Field(default_factory=ForwardConfig)
+    sockets: SocketsConfig = Field(default_factory=SocketsConfig)
+    bridge: BridgeConfig = Field(default_factory=BridgeConfig)
     secondary_agency: SecondaryAgencyConfig = Field(
         default_factory=SecondaryAgencyConfig
     )
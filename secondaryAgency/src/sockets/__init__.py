@@ -1,18 +1,71 @@
 from .server import *
 from .client import *
+from .shm import *
+from .queues import *
 import asyncio
+from loguru import logger
+from setting import settings, SocketNodeConfig
 
 """
-输入输出节点
+输入输出节点，每个节点按配置选择 tcp 或同机共享内存
 """
 
-receQueue = asyncio.Queue()
+
+def createNode(name: str, cfg: SocketNodeConfig, queue: asyncio.Queue, server: bool):
+    if cfg.transport == "shm":
+        return ShmNode(
+            cfg.shmName or f"secondaryAgency-{name}",
+            queue,
+            slots=cfg.shmSlots,
+            slotSize=cfg.shmSlotSize,
+            maxPollInterval=cfg.shmMaxPollInterval,
+        )
+    if server:
+        return AsyncServer(cfg.host, cfg.port, queue)
+    return AsyncClient(cfg.host, cfg.port, queue)
+
+
+def releaseDropped(item):
+    # 被丢弃的共享内存帧要归还槽位
+    if isinstance(item, ShmFrame):
+        item.release()
+
+
+receQueue = createQueue(
+    "receQueue",
+    settings.sockets.queueSize,
+    settings.sockets.queuePolicy,
+    onDrop=releaseDropped,
+)
 inputNet = {
-    "vision": AsyncServer("127.0.0.1", 60001, receQueue),
+    name: createNode(name, cfg, receQueue, True)
+    for name, cfg in settings.sockets.inputNet.items()
 }
 
 
-responseQueue = asyncio.Queue()
+responseQueue = createQueue(
+    "responseQueue",
+    settings.sockets.queueSize,
+    settings.sockets.queuePolicy,
+    onDrop=releaseDropped,
+)
 outputNet = {
-    "talk": AsyncClient("127.0.0.1", 50001, responseQueue),
+    name: createNode(name, cfg, responseQueue, False)
+    for name, cfg in settings.sockets.outputNet.items()
 }
+
+
+async def startNodes():
+    """
+    启动所有输入输出节点；客户端节点在后台连接并自动重连
+    """
+    for node in list(inputNet.values()) + list(outputNet.values()):
+        await node.createInit()
+
+
+async def stopNodes():
+    for node in list(inputNet.values()) + list(outputNet.values()):
+        try:
+            await node.offConnect()
+        except Exception as e:
+            logger.error(f"节点关闭失败 {e}")
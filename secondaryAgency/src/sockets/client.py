@@ -4,68 +4,90 @@
 
 """
 socket 转为其他协议
+输出节点客户端：断线自动重连（指数退避 + 抖动），断线期间的消息进有界缓存，重连后按序补发
 """
 
 import asyncio
-import json
-from typing import Dict
+import random
+from collections import deque
+from typing import Any, Deque, Literal, Optional
 from loguru import logger
+from setting import settings
+from .framing import encodeFrame
+from .connection import Connection
+from .queues import createQueue
+
+StateType = Literal[
+    "idle", "connecting", "replaying", "connected", "disconnected", "backoff", "closed"
+]
 
 
 class AsyncClient(object):
     name = "客户端"
 
-    def __init__(self, host, port, receQueue):
+    def __init__(
+        self,
+        host,
+        port,
+        receQueue,
+        codec: str = settings.sockets.codec,
+        maxFrameSize: int = settings.sockets.maxFrameSize,
+        idleTimeout: float = settings.sockets.idleTimeout,
+        pingInterval: float = settings.sockets.pingInterval,
+        connectTimeout: float = settings.sockets.connectTimeout,
+        reconnectBaseDelay: float = settings.sockets.reconnectBaseDelay,
+        reconnectMaxDelay: float = settings.sockets.reconnectMaxDelay,
+        replayBufferSize: int = settings.sockets.replayBufferSize,
+    ):
         self.host = host
         self.port = port
-        self.sendQueue = asyncio.Queue()
+        self.codec = codec
+        self.maxFrameSize = maxFrameSize
+        self.idleTimeout = idleTimeout
+        self.pingInterval = pingInterval
+        self.connectTimeout = connectTimeout
+        self.reconnectBaseDelay = reconnectBaseDelay
+        self.reconnectMaxDelay = reconnectMaxDelay
+        self.sendQueue = createQueue(
+            f"send-{host}:{port}",
+            settings.sockets.sendQueueSize,
+            settings.sockets.sendQueuePolicy,
+        )
         self.receQueue = receQueue
         self.reader = None
         self.writer = None
+        self.conn: Connection | None = None
+        self.task: Optional[asyncio.Task] = None
+        self.closing = False
+        self.state: StateType = "idle"
+        # 断线缓存，满了丢弃最旧的帧
+        self.replay: Deque[bytes] = deque(maxlen=replayBufferSize or None)
+        self.replayBufferSize = replayBufferSize
+        self.replayed = 0
+        self.replayDropped = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.connectFailures = 0
 
     @classmethod
     def setName(cls, n: str):
         cls.name = n
 
-    async def sendMsg(self, msg: Dict):
-        """
-        添加信息 到 发送队列
-        """
-        logger.info(f"从意识空间 发送到 输出节点{msg}")
-        await self.sendQueue.put(json.dumps(msg).encode())
-
-    async def sendLoop(self):
+    async def sendMsg(self, msg: Any, codec: str | None = None):
         """
-        从意识空间 发送到 输出节点
+        添加信息 到 发送队列；未连接（或正在补发）时进断线缓存
         """
-        try:
-            while True:
-                msg = await self.sendQueue.get()
-                if not msg:
-                    continue
-                self.writer.write(msg)
-                await self.writer.drain()
-                self.sendQueue.task_done()
-        except Exception as identifier:
-            logger.error("输出节点 发送问题", identifier)
-        finally:
-            if self.writer:
-                self.writer.close()
-                await self.writer.wait_closed()
-
-    async def receLoop(self):
-        """
-        从输出节点 发送到 意识空间
-        """
-        try:
-            while True:
-                data = await self.reader.read(1024)
-                if not data:
-                    break
-                node = json.loads(data.decode())
-                await self.receQueue.put(node)
-        except Exception as identifier:
-            logger.error("输出节点 接收问题", identifier)
+        logger.debug(f"从意识空间 发送到 输出节点{msg}")
+        frame = encodeFrame(msg, codec or self.codec)
+        if self.state == "connected":
+            await self.sendQueue.put(frame)
+            return
+        if self.replayBufferSize == 0:
+            self.replayDropped += 1
+            return
+        if len(self.replay) == self.replay.maxlen:
+            self.replayDropped += 1
+        self.replay.append(frame)
 
     async def testLoopSend(self):
         while True:
@@ -74,28 +96,106 @@ class AsyncClient(object):
 
     async def createInit(self):
         """
-        建立连接并启动读写任务
+        启动后台连接任务，断线后自动重连，不阻塞调用方
         """
-        try:
-            # 使用 asyncio.open_connection 建立连接
-            self.reader, self.writer = await asyncio.open_connection(
-                self.host, self.port
-            )
+        if self.task is None or self.task.done():
+            self.closing = False
+            self.task = asyncio.create_task(self.connectLoop())
+
+    def _backoff(self, attempt: int) -> float:
+        # 指数退避 + 全抖动，避免多个客户端同时重连
+        cap = min(self.reconnectMaxDelay, self.reconnectBaseDelay * 2**attempt)
+        return random.uniform(0, cap)
+
+    async def connectLoop(self):
+        """
+        连接 -> 重发断线缓存 -> 服务连接直到断开 -> 退避后重连
+        断开后第一次重连立即进行，连续失败才逐步拉长间隔
+        """
+        attempt = 0
+        while not self.closing:
+            self.state = "connecting"
+            try:
+                async with asyncio.timeout(self.connectTimeout):
+                    self.reader, self.writer = await asyncio.open_connection(
+                        self.host, self.port
+                    )
+            except (OSError, TimeoutError) as identifier:
+                self.connectFailures += 1
+                delay = self._backoff(attempt)
+                attempt += 1
+                self.state = "backoff"
+                logger.warning(
+                    f"输出节点 发送端 连接失败 {self.host}:{self.port} {identifier!r}，{delay:.3f}s 后重试"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            attempt = 0
+            if self.connects:
+                self.reconnects += 1
+            self.connects += 1
             logger.info(f"输出节点 发送端 建立 {self.host}:{self.port}")
-            # 启动独立的读写任务
-            async with asyncio.TaskGroup() as tg:
-                tg.create_task(self.sendLoop())
-                tg.create_task(self.receLoop())
-                # tg.create_task(self.testLoopSend())
+            # 读写循环共用发送队列，连接断开前未发出的消息仍留在队列里
+            self.conn = Connection(self.reader, self.writer, self.sendQueue)
+            runTask = asyncio.create_task(
+                self.conn.run(
+                    self.receQueue.put,
+                    self.maxFrameSize,
+                    self.idleTimeout,
+                    self.pingInterval,
+                    getattr(self.receQueue, "writable", None),
+                )
+            )
+            try:
+                self.state = "replaying"
+                await self._flushReplay(runTask)
+                if not runTask.done():
+                    self.state = "connected"
+                await runTask
+            except asyncio.CancelledError:
+                runTask.cancel()
+                await asyncio.gather(runTask, return_exceptions=True)
+                raise
+            except Exception as identifier:
+                logger.error(f"输出节点 发送端 {identifier!r}")
+            self.state = "disconnected"
+            logger.info(f"输出节点 发送端 断开 {self.conn.stats()}")
+        self.state = "closed"
 
-        except Exception as identifier:
-            logger.error(f"输出节点 发送端 {identifier}")
+    async def _flushReplay(self, runTask: asyncio.Task):
+        """
+        把断线期间缓存的帧按顺序补发；补发期间新消息继续进缓存，保证顺序
+        """
+        while self.replay and not runTask.done():
+            await self.sendQueue.put(self.replay.popleft())
+            self.replayed += 1
 
     async def offConnect(self):
         """
-        关闭客户端连接
+        关闭客户端连接并停止重连
         """
-        if self.writer:
-            self.writer.close()
-            await self.writer.wait_closed()
-            logger.info(f"输出节点 客户端关闭 {self.host}:{self.port}")
+        self.closing = True
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.conn is not None:
+            await self.conn.close()
+        self.state = "closed"
+        logger.info(f"输出节点 客户端关闭 {self.host}:{self.port}")
+
+    def stats(self):
+        return {
+            "address": f"{self.host}:{self.port}",
+            "state": self.state,
+            "connected": self.state == "connected",
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "connectFailures": self.connectFailures,
+            "replay": len(self.replay),
+            "replayed": self.replayed,
+            "replayDropped": self.replayDropped,
+            "sendQueue": self.sendQueue.stats(),
+            "connection": self.conn.stats() if self.conn is not None else None,
+        }
@@ -0,0 +1,227 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+"""
+单条 socket 连接的生命周期：收发循环、EOF/空闲超时检测、心跳、统计
+任一循环结束（对端关闭、超时、出错）都会拆掉整条连接，释放文件描述符
+"""
+
+import asyncio
+import itertools
+import socket
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+from loguru import logger
+from setting import settings
+from .framing import CODEC_CONTROL, FrameReader, PING, PING_FRAME, PONG_FRAME
+from .queues import createQueue
+
+_ids = itertools.count(1)
+
+
+class Connection(object):
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        sendQueue: Optional[asyncio.Queue] = None,
+        flushSize: int = settings.sockets.writeFlushSize,
+        flushInterval: float = settings.sockets.writeFlushInterval,
+        noDelay: bool = settings.sockets.noDelay,
+    ):
+        self.id = next(_ids)
+        self.reader = reader
+        self.writer = writer
+        self.peer = writer.get_extra_info("peername")
+        self.flushSize = flushSize
+        self.flushInterval = flushInterval
+        self.setNoDelay(noDelay)
+        if sendQueue is None:
+            sendQueue = createQueue(
+                f"send-{self.id}",
+                settings.sockets.sendQueueSize,
+                settings.sockets.sendQueuePolicy,
+            )
+        self.sendQueue = sendQueue
+        self.tags: Set[str] = set()
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+        # 统计
+        self.connectedAt = time.time()
+        self.lastRecv = time.monotonic()
+        self.lastSend = self.lastRecv
+        self.framesIn = 0
+        self.framesOut = 0
+        self.bytesOut = 0
+        self.writes = 0
+        self.pings = 0
+        self.frames: Optional[FrameReader] = None
+
+    def __repr__(self):
+        return f"Connection(id={self.id}, peer={self.peer}, tags={sorted(self.tags)})"
+
+    def setNoDelay(self, enable: bool):
+        """
+        asyncio 默认开启 TCP_NODELAY；关闭后由内核合并小包，换取更少的包数
+        """
+        sock = self.writer.get_extra_info("socket")
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(enable))
+
+    async def _gather(self, first: bytes) -> list:
+        """
+        以第一帧为起点，把队列里已有的帧合并成一批，直到达到 flushSize；
+        flushInterval > 0 时队列空了也会再等一会儿，凑更大的批
+        """
+        q = self.sendQueue
+        batch = [first]
+        size = len(first)
+        deadline = None
+        while size < self.flushSize:
+            try:
+                msg = q.get_nowait()
+            except asyncio.QueueEmpty:
+                if self.flushInterval <= 0:
+                    break
+                loop = asyncio.get_running_loop()
+                if deadline is None:
+                    deadline = loop.time() + self.flushInterval
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    async with asyncio.timeout(remaining):
+                        msg = await q.get()
+                except TimeoutError:
+                    break
+            batch.append(msg)
+            size += len(msg)
+        return batch
+
+    async def sendLoop(self):
+        """
+        一批帧只调用一次 writelines + drain，小消息不再每条一次系统调用
+        """
+        w = self.writer
+        while True:
+            batch = await self._gather(await self.sendQueue.get())
+            try:
+                frames = [msg for msg in batch if msg]
+                if not frames:
+                    continue
+                w.writelines(frames)
+                await w.drain()
+                self.writes += 1
+                self.framesOut += len(frames)
+                self.bytesOut += sum(map(len, frames))
+                self.lastSend = time.monotonic()
+            finally:
+                for _ in batch:
+                    self.sendQueue.task_done()
+
+    async def receLoop(
+        self,
+        onMessage: Callable[[Any], Awaitable],
+        maxFrameSize: int,
+        idleTimeout: float,
+        gate: Optional[asyncio.Event] = None,
+    ):
+        """
+        idleTimeout 内收不到任何帧（含心跳回复）视为对端失联；对端关闭时正常返回
+        gate 未置位时（下游队列到达高水位）暂停读取，背压经 TCP 传回对端
+        """
+        self.frames = FrameReader(self.reader, maxFrameSize)
+        while True:
+            if gate is not None and not gate.is_set():
+                await gate.wait()
+                self.lastRecv = time.monotonic()
+            try:
+                async with asyncio.timeout(idleTimeout or None):
+                    frame = await self.frames.read()
+            except TimeoutError:
+                logger.warning(f"{self} 读空闲超过 {idleTimeout}s，断开")
+                return
+            if frame is None:
+                logger.info(f"{self} 对端关闭")
+                return
+            self.lastRecv = time.monotonic()
+            self.framesIn += 1
+            cid, node = frame
+            if cid == CODEC_CONTROL:
+                if node == PING:
+                    await self.sendQueue.put(PONG_FRAME)
+                continue
+            await onMessage(node)
+
+    async def keepalive(self, interval: float):
+        """
+        一段时间没收到对端数据就发心跳，对端回 pong 即刷新 lastRecv
+        """
+        while True:
+            await asyncio.sleep(interval)
+            if time.monotonic() - self.lastRecv >= interval:
+                self.pings += 1
+                await self.sendQueue.put(PING_FRAME)
+
+    async def run(
+        self,
+        onMessage: Callable[[Any], Awaitable],
+        maxFrameSize: int,
+        idleTimeout: float = 0,
+        pingInterval: float = 0,
+        gate: Optional[asyncio.Event] = None,
+    ):
+        """
+        服务这条连接直到任一循环结束，然后取消其余循环并关闭连接
+        """
+        self.task = asyncio.current_task()
+        tasks = [
+            asyncio.create_task(self.sendLoop()),
+            asyncio.create_task(
+                self.receLoop(onMessage, maxFrameSize, idleTimeout, gate)
+            ),
+        ]
+        if pingInterval > 0:
+            tasks.append(asyncio.create_task(self.keepalive(pingInterval)))
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if not t.cancelled() and t.exception() is not None:
+                    logger.error(f"{self} 连接异常：{t.exception()!r}")
+        finally:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.close()
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "id": self.id,
+            "peer": self.peer,
+            "tags": sorted(self.tags),
+            "connectedAt": self.connectedAt,
+            "idle": round(now - self.lastRecv, 3),
+            "framesIn": self.framesIn,
+            "framesOut": self.framesOut,
+            "bytesIn": self.frames.bytesIn if self.frames else 0,
+            "bytesOut": self.bytesOut,
+            "writes": self.writes,
+            "pings": self.pings,
+            "sendQueue": (
+                self.sendQueue.stats()
+                if hasattr(self.sendQueue, "stats")
+                else self.sendQueue.qsize()
+            ),
+        }
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+"""
+socket 帧协议：4 字节大端长度 + 1 字节编码 id + 消息体
+解析复用同一块缓冲区，一次 read 读到多帧或半帧都能正确切分
+"""
+
+import struct
+from typing import Any, Callable, Dict, Optional, Tuple
+import orjson
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+HEADER = struct.Struct("!IB")
+
+CODEC_RAW = 0
+CODEC_JSON = 1
+CODEC_MSGPACK = 2
+# 连接控制帧（心跳），不会进入业务队列
+CODEC_CONTROL = 255
+PING = b"ping"
+PONG = b"pong"
+
+
+class FrameError(Exception):
+    pass
+
+
+class Codec:
+    __slots__ = ("id", "name", "encode", "decode")
+
+    def __init__(
+        self,
+        id: int,
+        name: str,
+        encode: Callable[[Any], bytes],
+        decode: Callable[[memoryview], Any],
+    ):
+        self.id = id
+        self.name = name
+        self.encode = encode
+        self.decode = decode
+
+
+codecsById: Dict[int, Codec] = {}
+codecsByName: Dict[str, Codec] = {}
+
+
+def registerCodec(id: int, name: str, encode, decode):
+    """
+    注册编解码器，decode 拿到的是缓冲区的 memoryview，需要保留数据时自行拷贝
+    """
+    if not 0 <= id <= 255:
+        raise ValueError("编码 id 必须在 0~255 之间")
+    codec = Codec(id, name, encode, decode)
+    codecsById[id] = codec
+    codecsByName[name] = codec
+    return codec
+
+
+def getCodec(codec: int | str) -> Codec:
+    table = codecsById if isinstance(codec, int) else codecsByName
+    try:
+        return table[codec]
+    except KeyError:
+        raise FrameError(f"未注册的编码：{codec}") from None
+
+
+registerCodec(CODEC_RAW, "raw", bytes, bytes)
+registerCodec(CODEC_JSON, "json", orjson.dumps, orjson.loads)
+registerCodec(CODEC_CONTROL, "control", bytes, bytes)
+if msgpack is not None:
+    registerCodec(
+        CODEC_MSGPACK,
+        "msgpack",
+        lambda obj: msgpack.packb(obj, use_bin_type=True),
+        lambda view: msgpack.unpackb(view, raw=False),
+    )
+
+
+def encodeFrame(obj: Any, codec: int | str = CODEC_JSON) -> bytes:
+    c = getCodec(codec)
+    body = c.encode(obj)
+    return HEADER.pack(len(body), c.id) + body
+
+
+PING_FRAME = encodeFrame(PING, CODEC_CONTROL)
+PONG_FRAME = encodeFrame(PONG, CODEC_CONTROL)
+
+
+class FrameReader:
+    def __init__(self, reader, maxFrameSize: int = 64 * 1024 * 1024, readSize: int = 65536):
+        self.reader = reader
+        self.maxFrameSize = maxFrameSize
+        self.readSize = readSize
+        self.buf = bytearray()
+        self.pos = 0
+        self.bytesIn = 0
+
+    def _parse(self) -> Optional[Tuple[int, Any]]:
+        buf = self.buf
+        avail = len(buf) - self.pos
+        if avail < HEADER.size:
+            return None
+        length, cid = HEADER.unpack_from(buf, self.pos)
+        if length > self.maxFrameSize:
+            raise FrameError(f"帧长度 {length} 超过上限 {self.maxFrameSize}")
+        if avail < HEADER.size + length:
+            return None
+        start = self.pos + HEADER.size
+        codec = getCodec(cid)
+        with memoryview(buf) as view, view[start : start + length] as body:
+            obj = codec.decode(body)
+        self.pos = start + length
+        # 已消费的部分过半再整体前移，避免每帧都搬移内存
+        if self.pos == len(buf):
+            buf.clear()
+            self.pos = 0
+        elif self.pos > len(buf) // 2:
+            del buf[: self.pos]
+            self.pos = 0
+        return cid, obj
+
+    def _missing(self) -> int:
+        """
+        当前帧还差多少字节，大帧一次读够，减少 read 次数
+        """
+        avail = len(self.buf) - self.pos
+        if avail < HEADER.size:
+            return HEADER.size - avail
+        length, _ = HEADER.unpack_from(self.buf, self.pos)
+        return HEADER.size + length - avail
+
+    async def read(self) -> Optional[Tuple[int, Any]]:
+        """
+        返回 (编码 id, 解码后的对象)；对端正常关闭返回 None
+        """
+        while True:
+            frame = self._parse()
+            if frame is not None:
+                return frame
+            chunk = await self.reader.read(max(self.readSize, self._missing()))
+            if not chunk:
+                if len(self.buf) > self.pos:
+                    raise FrameError("连接关闭时存在不完整的帧")
+                return None
+            self.bytesIn += len(chunk)
+            self.buf += chunk
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+"""
+有界队列：满了之后的处理策略、高低水位回调、深度与排队时延统计
+block       队列满时 put 等待（默认）
+dropOldest  丢弃最旧的一条再入队
+dropNewest  丢弃新来的这条
+coalesce    相同 key 的消息原位替换为最新值，新 key 且队列满时等待
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Hashable, Literal, Optional
+from setting import settings
+
+PolicyType = Literal["block", "dropOldest", "dropNewest", "coalesce"]
+
+
+class BoundedQueue(asyncio.Queue):
+    def __init__(
+        self,
+        maxsize: int,
+        policy: PolicyType = "block",
+        key: Optional[Callable[[Any], Hashable]] = None,
+        highWatermark: Optional[int] = None,
+        lowWatermark: Optional[int] = None,
+        onHigh: Optional[Callable[["BoundedQueue"], Any]] = None,
+        onLow: Optional[Callable[["BoundedQueue"], Any]] = None,
+        onDrop: Optional[Callable[[Any], Any]] = None,
+        name: str = "",
+    ):
+        if maxsize <= 0:
+            raise ValueError("BoundedQueue 必须有上限")
+        if policy == "coalesce" and key is None:
+            raise ValueError("coalesce 策略需要提供 key")
+        self.policy = policy
+        self.key = key
+        self.name = name
+        self.highWatermark = highWatermark or maxsize
+        self.lowWatermark = lowWatermark if lowWatermark is not None else maxsize // 2
+        self.onHigh = onHigh
+        self.onLow = onLow
+        # 被丢弃/被覆盖的消息回调，例如归还共享内存槽位
+        self.onDrop = onDrop
+        # 高水位时清除，上游读取前等待它，从而暂停读取
+        self.writable = asyncio.Event()
+        self.writable.set()
+        self.dropped = 0
+        self.coalesced = 0
+        self.highHits = 0
+        self.puts = 0
+        self.gets = 0
+        self.latencyAvg = 0.0
+        self.latencyMax = 0.0
+        super().__init__(maxsize)
+
+    # ---- asyncio.Queue 存储钩子，元素为 [入队时间, 值, key] ----
+    def _init(self, maxsize):
+        self._queue = deque()
+        self._index: Dict[Hashable, list] = {}
+
+    def _put(self, item):
+        k = self.key(item) if self.policy == "coalesce" else None
+        entry = [time.monotonic(), item, k]
+        self._queue.append(entry)
+        if k is not None:
+            self._index[k] = entry
+
+    def _get(self):
+        ts, item, k = self._queue.popleft()
+        if k is not None:
+            self._index.pop(k, None)
+        wait = time.monotonic() - ts
+        self.latencyAvg += (wait - self.latencyAvg) * 0.1
+        if wait > self.latencyMax:
+            self.latencyMax = wait
+        self.gets += 1
+        if not self.writable.is_set() and len(self._queue) <= self.lowWatermark:
+            self.writable.set()
+            if self.onLow is not None:
+                self.onLow(self)
+        return item
+
+    # ---- 入队策略 ----
+    def _coalesce(self, item) -> bool:
+        if self.policy != "coalesce":
+            return False
+        entry = self._index.get(self.key(item))
+        if entry is None:
+            return False
+        old, entry[1] = entry[1], item
+        self.coalesced += 1
+        self._dropped(old)
+        return True
+
+    def _dropped(self, item):
+        if self.onDrop is not None:
+            self.onDrop(item)
+
+    def put_nowait(self, item):
+        if self._coalesce(item):
+            return
+        if self.full():
+            if self.policy == "dropNewest":
+                self.dropped += 1
+                self._dropped(item)
+                return
+            if self.policy == "dropOldest":
+                _, old, k = self._queue.popleft()
+                if k is not None:
+                    self._index.pop(k, None)
+                self.task_done()
+                self.dropped += 1
+                self._dropped(old)
+        super().put_nowait(item)
+        self.puts += 1
+        if self.writable.is_set() and self.qsize() >= self.highWatermark:
+            self.writable.clear()
+            self.highHits += 1
+            if self.onHigh is not None:
+                self.onHigh(self)
+
+    async def put(self, item):
+        if self.policy in ("dropOldest", "dropNewest"):
+            return self.put_nowait(item)
+        if self._coalesce(item):
+            return
+        return await super().put(item)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "policy": self.policy,
+            "depth": self.qsize(),
+            "maxsize": self.maxsize,
+            "paused": not self.writable.is_set(),
+            "puts": self.puts,
+            "gets": self.gets,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "highHits": self.highHits,
+            "latencyAvg": round(self.latencyAvg, 6),
+            "latencyMax": round(self.latencyMax, 6),
+        }
+
+
+def coalesceBy(field: str) -> Callable[[Any], Hashable]:
+    """
+    按 dict 消息中的字段合并，非 dict 消息不合并
+    """
+
+    def key(msg):
+        if isinstance(msg, dict) and field in msg:
+            return (field, msg[field])
+        return id(msg)
+
+    return key
+
+
+def createQueue(
+    name: str,
+    maxsize: int,
+    policy: PolicyType,
+    onDrop: Optional[Callable[[Any], Any]] = None,
+) -> BoundedQueue:
+    """
+    按配置创建有界队列，水位为上限的比例
+    """
+    cfg = settings.sockets
+    key = coalesceBy(cfg.coalesceKey) if policy == "coalesce" else None
+    return BoundedQueue(
+        maxsize,
+        policy,
+        key=key,
+        highWatermark=max(1, int(maxsize * cfg.highWatermark)),
+        lowWatermark=int(maxsize * cfg.lowWatermark),
+        onDrop=onDrop,
+        name=name,
+    )
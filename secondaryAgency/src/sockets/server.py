@@ -7,69 +7,176 @@ socket 转为其他协议
 """
 
 import asyncio
-import json
-from typing import Dict
+from functools import partial
+from typing import Any, Dict, Iterable, Set
 from loguru import logger
+from setting import settings
+from .framing import encodeFrame
+from .connection import Connection
 
 
 class AsyncServer(object):
     name = "服务端"
 
-    def __init__(self, host, port, receQueue):
+    def __init__(
+        self,
+        host,
+        port,
+        receQueue,
+        codec: str = settings.sockets.codec,
+        maxFrameSize: int = settings.sockets.maxFrameSize,
+        maxConnections: int = settings.sockets.maxConnections,
+        idleTimeout: float = settings.sockets.idleTimeout,
+        pingInterval: float = settings.sockets.pingInterval,
+    ):
         self.host = host
         self.port = port
-        self.sendQueue = asyncio.Queue()
+        self.codec = codec
+        self.maxFrameSize = maxFrameSize
+        self.maxConnections = maxConnections
+        self.idleTimeout = idleTimeout
+        self.pingInterval = pingInterval
+        self.rejected = 0
+        self.server = None
         self.receQueue = receQueue
+        # 连接注册表：连接 id -> 连接，标签 -> 连接 id
+        self.connections: Dict[int, Connection] = {}
+        self.tagIndex: Dict[str, Set[int]] = {}
+        # block 策略下等待发送队列空位的入队，连接 id -> 任务
+        self.blockedPuts: Dict[int, Set[asyncio.Task]] = {}
 
     @classmethod
     def setName(cls, n: str):
         cls.name = n
 
-    async def sendMsg(self, msg: Dict):
+    async def sendMsg(self, msg: Any, codec: str | None = None):
         """
-        服务端要发给输入节点的内容
+        服务端要发给输入节点的内容，发给所有已连接的输入节点
         """
-        await self.sendQueue.put(json.dumps(msg).encode())
+        await self.broadcast(msg, codec)
 
-    async def sendLoop(self, w):
+    async def _deliver(self, conns: Iterable[Connection], msg: Any, codec: str | None):
+        # 只编码一次，所有接收方共享同一份 bytes
+        frame = encodeFrame(msg, codec or self.codec)
+        # !先不等待地放进每个连接的发送队列（drop 策略由队列自己处理），
+        # 只有 block 策略且已满的连接才等待，并且一起等，慢连接不会挡住其他连接；
+        # 等待中的连接断开时由 unregister 取消，不会永远挂住
+        count = 0
+        blocked = []
+        for conn in conns:
+            if conn.closed or self.connections.get(conn.id) is not conn:
+                continue
+            try:
+                conn.sendQueue.put_nowait(frame)
+            except asyncio.QueueFull:
+                task = asyncio.ensure_future(conn.sendQueue.put(frame))
+                self.blockedPuts.setdefault(conn.id, set()).add(task)
+                task.add_done_callback(partial(self._putDone, conn.id))
+                blocked.append(task)
+                continue
+            count += 1
+        if blocked:
+            results = await asyncio.gather(*blocked, return_exceptions=True)
+            count += sum(1 for r in results if not isinstance(r, BaseException))
+        return count
+
+    def _putDone(self, connId: int, task: asyncio.Task):
+        tasks = self.blockedPuts.get(connId)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self.blockedPuts[connId]
+
+    async def unicast(self, connId: int, msg: Any, codec: str | None = None) -> bool:
         """
-        从意识空间 发送给 输入节点
+        发给指定连接
         """
-        try:
-            while True:
-                msg = await self.sendQueue.get()
-                if not msg:
-                    continue
-                w.write(msg)
-                await w.drain()
-                self.sendQueue.task_done()
-        except Exception as identifier:
-            logger.info("输入节点 服务端 发送问题", identifier)
-        finally:
-            w.close()
-            await w.wait_closed()
+        conn = self.connections.get(connId)
+        if conn is None:
+            return False
+        await self._deliver((conn,), msg, codec)
+        return True
 
-    async def receLoop(self, r):
+    async def multicast(self, tag: str, msg: Any, codec: str | None = None) -> int:
         """
-        从输入节点 发送给 意识空间
+        发给带有指定标签的连接，返回接收方数量
         """
-        try:
-            while True:
-                data = await r.read(1024)
-                if not data:
-                    continue
-                node = json.loads(data.decode())
-                await self.receQueue.put(node)
-        except Exception as identifier:
-            logger.info("输入节点 服务端 接收问题", identifier)
+        ids = self.tagIndex.get(tag, ())
+        conns = [self.connections[i] for i in ids if i in self.connections]
+        return await self._deliver(conns, msg, codec)
+
+    async def broadcast(self, msg: Any, codec: str | None = None) -> int:
+        """
+        发给所有连接，返回接收方数量
+        """
+        return await self._deliver(list(self.connections.values()), msg, codec)
+
+    def tag(self, connId: int, *tags: str):
+        conn = self.connections.get(connId)
+        if conn is None:
+            return
+        for t in tags:
+            conn.tags.add(t)
+            self.tagIndex.setdefault(t, set()).add(connId)
+
+    def untag(self, connId: int, *tags: str):
+        conn = self.connections.get(connId)
+        if conn is None:
+            return
+        for t in tags:
+            conn.tags.discard(t)
+            ids = self.tagIndex.get(t)
+            if ids is not None:
+                ids.discard(connId)
+                if not ids:
+                    del self.tagIndex[t]
+
+    def register(self, conn: Connection):
+        self.connections[conn.id] = conn
+
+    def unregister(self, conn: Connection):
+        self.untag(conn.id, *list(conn.tags))
+        self.connections.pop(conn.id, None)
+        # 连接已经没人消费发送队列，取消还在等空位的入队
+        for task in list(self.blockedPuts.pop(conn.id, ())):
+            task.cancel()
 
     async def handle_echo(self, reader, writer):
         """
-        回调构建
+        回调构建，连接结束（EOF、超时、出错）后注销并释放资源
         """
-        async with asyncio.TaskGroup() as tg:
-            tg.create_task(self.sendLoop(writer))
-            tg.create_task(self.receLoop(reader))
+        if len(self.connections) >= self.maxConnections:
+            self.rejected += 1
+            logger.warning(
+                f"输入节点 服务端 连接数已达上限 {self.maxConnections}，拒绝 {writer.get_extra_info('peername')}"
+            )
+            writer.close()
+            await writer.wait_closed()
+            return
+        conn = Connection(reader, writer)
+        self.register(conn)
+        logger.info(f"输入节点 服务端 新连接 {conn}")
+        try:
+            await conn.run(
+                self.receQueue.put,
+                self.maxFrameSize,
+                self.idleTimeout,
+                self.pingInterval,
+                getattr(self.receQueue, "writable", None),
+            )
+        except asyncio.CancelledError:
+            # 服务端关闭时主动取消，连接已在 run 中关闭
+            pass
+        finally:
+            self.unregister(conn)
+            logger.info(f"输入节点 服务端 连接关闭 {conn.stats()}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "address": f"{self.host}:{self.port}",
+            "rejected": self.rejected,
+            "connections": [conn.stats() for conn in self.connections.values()],
+        }
 
     async def createInit(self):
         self.server = await asyncio.start_server(self.handle_echo, self.host, self.port)
@@ -82,6 +189,10 @@ class AsyncServer(object):
         """
         if self.server:
             self.server.close()
+            # 主动断开存量连接，否则 wait_closed 会一直等待
+            for conn in list(self.connections.values()):
+                if conn.task is not None:
+                    conn.task.cancel()
             await self.server.wait_closed()
             self.task.cancel()
             logger.info(f"输入节点 服务端关闭 {self.host}:{self.port}")
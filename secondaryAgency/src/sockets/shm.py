@@ -0,0 +1,252 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+"""
+同机节点的共享内存传输：定长槽位的单生产者单消费者环形缓冲
+raw 帧以 memoryview（可转 NumPy）直接交给队列，不序列化、不拷贝；消费方用完必须 release()
+槽位状态在数据写完后才置为 FULL，依赖 x86 等平台的写入顺序保证
+"""
+
+import asyncio
+import struct
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Optional
+from loguru import logger
+from setting import settings
+from .framing import CODEC_RAW, getCodec
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖
+    np = None
+
+SLOT_EMPTY = 0
+SLOT_FULL = 1
+# 槽位头：状态、长度、编码 id
+SLOT_HEADER = struct.Struct("<IIB3x")
+# 环形缓冲头：槽位数、槽位大小
+RING_HEADER = struct.Struct("<II")
+
+
+class ShmFrame(object):
+    """
+    指向共享内存槽位的视图（底层可写，消费方不要改写内容），release 后生产方才能复用该槽位
+    """
+
+    __slots__ = ("ring", "index", "view")
+
+    def __init__(self, ring: "ShmRing", index: int, view: memoryview):
+        self.ring = ring
+        self.index = index
+        self.view = view
+
+    def asarray(self, dtype: Any = "uint8", shape: Optional[tuple] = None):
+        if np is None:
+            raise RuntimeError("未安装 numpy")
+        arr = np.frombuffer(self.view, dtype=dtype)
+        return arr.reshape(shape) if shape is not None else arr
+
+    def release(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+            self.ring.release(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __len__(self):
+        return 0 if self.view is None else self.view.nbytes
+
+
+class ShmRing(object):
+    def __init__(self, name: str, slots: int, slotSize: int, create: bool):
+        self.name = name
+        self.create = create
+        stride = SLOT_HEADER.size + slotSize
+        if create:
+            self.shm = SharedMemory(name, create=True, size=RING_HEADER.size + slots * stride)
+            RING_HEADER.pack_into(self.shm.buf, 0, slots, slotSize)
+            for i in range(slots):
+                SLOT_HEADER.pack_into(self.shm.buf, RING_HEADER.size + i * stride, SLOT_EMPTY, 0, 0)
+        else:
+            self.shm = SharedMemory(name)
+            # 非创建方不负责回收，避免 resource_tracker 在退出时误删
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+            slots, slotSize = RING_HEADER.unpack_from(self.shm.buf, 0)
+            stride = SLOT_HEADER.size + slotSize
+        self.slots = slots
+        self.slotSize = slotSize
+        self.stride = stride
+        self.head = 0  # 生产方下一个写入槽位
+        self.tail = 0  # 消费方下一个读取槽位
+
+    def _offset(self, index: int) -> int:
+        return RING_HEADER.size + index * self.stride
+
+    def put(self, data, codecId: int = CODEC_RAW) -> bool:
+        """
+        写入一帧，环满返回 False
+        """
+        with memoryview(data) as src, src.cast("B") as body:
+            if body.nbytes > self.slotSize:
+                raise ValueError(f"帧长度 {body.nbytes} 超过槽位大小 {self.slotSize}")
+            off = self._offset(self.head)
+            state, _, _ = SLOT_HEADER.unpack_from(self.shm.buf, off)
+            if state != SLOT_EMPTY:
+                return False
+            start = off + SLOT_HEADER.size
+            self.shm.buf[start : start + body.nbytes] = body
+            SLOT_HEADER.pack_into(self.shm.buf, off, SLOT_FULL, body.nbytes, codecId)
+        self.head = (self.head + 1) % self.slots
+        return True
+
+    def get(self) -> Optional[tuple]:
+        """
+        取出一帧 (编码 id, ShmFrame)，没有数据返回 None
+        """
+        off = self._offset(self.tail)
+        state, length, codecId = SLOT_HEADER.unpack_from(self.shm.buf, off)
+        if state != SLOT_FULL:
+            return None
+        start = off + SLOT_HEADER.size
+        frame = ShmFrame(self, self.tail, self.shm.buf[start : start + length])
+        self.tail = (self.tail + 1) % self.slots
+        return codecId, frame
+
+    def release(self, index: int):
+        if self.shm.buf is None:
+            # 环已关闭，晚到的 release 不用再归还槽位
+            return
+        SLOT_HEADER.pack_into(self.shm.buf, self._offset(index), SLOT_EMPTY, 0, 0)
+
+    def used(self) -> int:
+        return sum(
+            SLOT_HEADER.unpack_from(self.shm.buf, self._offset(i))[0] == SLOT_FULL
+            for i in range(self.slots)
+        )
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            # 映射要等这些帧释放后才能关闭，但名字照样删掉，否则下次 create 会 FileExistsError
+            logger.warning(f"共享内存 {self.name} 仍有未 release 的帧")
+        if self.create:
+            self.shm.unlink()
+
+
+class ShmNode(object):
+    """
+    共享内存节点，接口与 AsyncServer/AsyncClient 保持一致
+    创建方使用 <name>-in 接收、<name>-out 发送；对端以 create=False 打开，方向相反
+    """
+
+    name = "共享内存"
+
+    def __init__(
+        self,
+        shmName: str,
+        receQueue,
+        slots: int = 32,
+        slotSize: int = 1024 * 1024,
+        create: bool = True,
+        codec: str = settings.sockets.codec,
+        pollInterval: float = 0.0005,
+        maxPollInterval: float = 0.02,
+    ):
+        self.shmName = shmName
+        self.receQueue = receQueue
+        self.slots = slots
+        self.slotSize = slotSize
+        self.create = create
+        self.codec = codec
+        # 空闲时轮询间隔从 pollInterval 开始翻倍，最长 maxPollInterval，有数据后恢复
+        self.pollInterval = pollInterval
+        self.maxPollInterval = max(maxPollInterval, pollInterval)
+        self.inbound: Optional[ShmRing] = None
+        self.outbound: Optional[ShmRing] = None
+        self.task: Optional[asyncio.Task] = None
+        self.framesIn = 0
+        self.framesOut = 0
+        self.fullWaits = 0
+
+    async def createInit(self):
+        inName, outName = f"{self.shmName}-in", f"{self.shmName}-out"
+        if not self.create:
+            inName, outName = outName, inName
+        self.inbound = ShmRing(inName, self.slots, self.slotSize, self.create)
+        self.outbound = ShmRing(outName, self.slots, self.slotSize, self.create)
+        self.task = asyncio.create_task(self.receLoop())
+        logger.info(f"共享内存节点建立 {inName} / {outName}")
+
+    async def receLoop(self):
+        """
+        轮询入站环；raw 帧零拷贝入队，其他编码就地解码后立即释放槽位
+        """
+        ring = self.inbound
+        gate = getattr(self.receQueue, "writable", None)
+        delay = self.pollInterval
+        while True:
+            if gate is not None and not gate.is_set():
+                # 下游到达高水位，暂停消费，生产方会因环满而等待
+                await gate.wait()
+            item = ring.get()
+            if item is None:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.maxPollInterval)
+                continue
+            delay = self.pollInterval
+            codecId, frame = item
+            self.framesIn += 1
+            if codecId == CODEC_RAW:
+                await self.receQueue.put(frame)
+            else:
+                with frame:
+                    node = getCodec(codecId).decode(frame.view)
+                await self.receQueue.put(node)
+
+    async def sendMsg(self, msg: Any, codec: str | None = None):
+        """
+        bytes/memoryview/ndarray 等缓冲区按 raw 写入，其余对象按编码序列化；环满时等待
+        """
+        isBuffer = isinstance(msg, (bytes, bytearray, memoryview)) or (
+            np is not None and isinstance(msg, np.ndarray)
+        )
+        if codec is None and isBuffer:
+            data, codecId = msg, CODEC_RAW
+        else:
+            c = getCodec(codec or self.codec)
+            data, codecId = c.encode(msg), c.id
+        delay = self.pollInterval
+        while not self.outbound.put(data, codecId):
+            self.fullWaits += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.maxPollInterval)
+        self.framesOut += 1
+
+    async def offConnect(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        for ring in (self.inbound, self.outbound):
+            if ring is not None:
+                ring.close()
+        logger.info(f"共享内存节点关闭 {self.shmName}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "shm": self.shmName,
+            "slots": self.slots,
+            "slotSize": self.slotSize,
+            "inboundUsed": self.inbound.used() if self.inbound else 0,
+            "outboundUsed": self.outbound.used() if self.outbound else 0,
+            "framesIn": self.framesIn,
+            "framesOut": self.framesOut,
+            "fullWaits": self.fullWaits,
+        }